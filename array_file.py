@@ -0,0 +1,100 @@
+"""Files of named arrays that can be memory-mapped.
+
+An array file is a single binary file:
+
+    8 bytes     the magic string "EDENDATA"
+    8 bytes     the length of the header (little-endian unsigned int)
+    header      JSON, saying where each array is and holding other values
+    arrays      the raw array data, each starting on a 64 byte boundary
+
+Because the arrays are stored raw they can be memory-mapped when read.
+"""
+
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+
+magic = "EDENDATA"
+version = 1
+alignment = 64
+
+
+def write_arrays(path, arrays, values):
+    """Write arrays (a dict of arrays) and values (a dict) to path.
+
+    The file is written under a temporary name in the same directory and
+    then renamed, so path never holds a partly written file and writers of
+    the same path do not write over each other's files.
+    """
+    header = {"version": version, "values": values, "arrays": {}}
+    offset = 0
+    for name in sorted(arrays):
+        array = np.ascontiguousarray(arrays[name])
+        arrays[name] = array
+        header["arrays"][name] = {"dtype": array.dtype.str,
+                                  "shape": list(array.shape),
+                                  "offset": offset}
+        offset += padded(array.nbytes)
+
+    text = json.dumps(header)
+    start = padded(len(magic) + 8 + len(text))
+    descriptor, temporary = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".",
+        prefix=os.path.basename(path) + ".")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(magic)
+            f.write(struct.pack("<Q", len(text)))
+            f.write(text)
+            for name in sorted(arrays):
+                f.seek(start + header["arrays"][name]["offset"])
+                f.write(arrays[name].tobytes())
+            f.truncate(start + offset)
+        os.rename(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def read_arrays(path, mmap=True):
+    """Read the arrays and values written to path by write_arrays.
+
+    If mmap is True the arrays are memory-mapped copy-on-write: changing
+    them does not change the file. Raises a ValueError if path is not an
+    array file or is cut short.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError("{} is not an Eden array file".format(path))
+        length = f.read(8)
+        if len(length) < 8:
+            raise ValueError("{} is cut short".format(path))
+        length = struct.unpack("<Q", length)[0]
+        header = json.loads(f.read(length))
+        if header["version"] != version:
+            raise ValueError("{} is a version {} array file, expected {}"
+                             .format(path, header["version"], version))
+        start = padded(len(magic) + 8 + length)
+
+        arrays = {}
+        for name, info in header["arrays"].items():
+            # names come out of the JSON header as unicode
+            name = str(name)
+            dtype = np.dtype(str(info["dtype"]))
+            shape = tuple(info["shape"])
+            if mmap and np.prod(shape) > 0:
+                arrays[name] = np.memmap(f, dtype=dtype, mode="c",
+                                         offset=start + info["offset"],
+                                         shape=shape)
+            else:
+                f.seek(start + info["offset"])
+                arrays[name] = np.fromfile(
+                    f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    return arrays, header["values"]
+
+
+def padded(n):
+    """n rounded up to a multiple of alignment."""
+    return -(-n // alignment) * alignment
@@ -0,0 +1,202 @@
+"""Running a world's physics in latitude bands, one process per band.
+
+Cells are laid out ring by ring, so a band of whole rings is a contiguous
+range of cells. Bands splits a WorldState into settings.bands such bands.
+Each band is owned by a worker process, and the state's arrays are moved
+into shared memory that every process works on directly.
+
+Within a column, the physics only touches a cell's own values, so each
+worker runs those phases on the cells it owns in place. Sloshing and
+conduction between cells use the edge schemes (slosh_oceans_by_edge and
+transfer_energy_horizontally_by_edge). For those, each worker first copies
+its cells and the halo of cells around them into arrays of its own. This
+halo exchange happens once per phase, before any worker writes. The
+worker then runs the phase on its copy and writes back the cells it owns.
+
+The edge schemes limit what crosses each edge by totals over the edges of
+both its cells. So the halo must hold every edge of every cell next to the
+band, which is two rings deep. The band's edges are then the state's edges
+in the same order, and every sum over a cell's edges adds the same terms in
+the same order. So the results match a single process bit for bit.
+"""
+
+import multiprocessing
+import traceback
+import numpy as np
+from world_state import WorldState
+
+# the arrays that can change, which are moved into shared memory
+shared_fields = ["land_mass", "land_energy", "land_height", "water_mass",
+                 "water_energy"]
+# the arrays the edge phases change, which bands write back
+edge_fields = ["land_energy", "water_mass", "water_energy"]
+# the phases that move energy or water between cells, as the WorldState
+# method each band runs
+edge_phases = {
+    "slosh_oceans": "slosh_oceans_by_edge",
+    "transfer_energy_horizontally": "transfer_energy_horizontally_by_edge"
+}
+# the rings of halo each side of a band (see above)
+halo_rings = 2
+
+
+class Bands():
+    """Worker processes that each run the physics of a latitude band.
+
+    Run a phase with run_phase. Between phases the workers wait, so the
+    state's arrays can be read and changed as usual.
+    """
+
+    def __init__(self, state, ring_index, count):
+        """Split state, whose rings are in ring_index, into count bands.
+
+        The state's arrays in shared_fields are replaced by copies in
+        shared memory.
+        """
+        for field in shared_fields:
+            setattr(state, field, shared_copy(getattr(state, field)))
+        self.state = state
+        self.rings = band_rings(ring_index.counts, count)
+
+        self.connections = []
+        self.processes = []
+        for first, last in zip(self.rings[:-1], self.rings[1:]):
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_band,
+                args=(worker_connection, state, ring_index, first, last))
+            process.daemon = True
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def __len__(self):
+        """The number of bands."""
+        return len(self.processes)
+
+    def run_phase(self, name):
+        """Run the phase called name on every band, with the state's Config.
+
+        Returns once every band has finished.
+        """
+        if name in edge_phases:
+            self.command("exchange_halo")
+        self.command("run_phase", name, self.state.config)
+
+    def command(self, name, *args):
+        """Have every band run its method called name, and wait for them.
+
+        Raises a RuntimeError if any of them fails.
+        """
+        for connection in self.connections:
+            connection.send((name, args))
+        errors = [connection.recv() for connection in self.connections]
+        for error in errors:
+            if error is not None:
+                raise RuntimeError("a band failed:\n" + error)
+
+    def close(self):
+        """Stop the worker processes."""
+        for connection in self.connections:
+            connection.send((None, ()))
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
+
+
+class Band():
+    """The cells of one latitude band, in the process that owns them."""
+
+    def __init__(self, state, ring_index, first, last):
+        """Own the cells in rings first to last - 1 of state."""
+        self.state = state
+        self.start = int(ring_index.offsets[first])
+        self.stop = self.start + int(ring_index.counts[first:last].sum())
+
+        # the owned cells, as a state of views onto the shared arrays
+        self.own = WorldState(state.latitude[self.start:self.stop],
+                              state.longitude[self.start:self.stop],
+                              state.config)
+        for field in shared_fields:
+            setattr(self.own, field,
+                    getattr(state, field)[self.start:self.stop])
+
+        # the owned cells and their halo, as a state of copies
+        low = max(0, first - halo_rings)
+        high = min(len(ring_index), last + halo_rings)
+        self.low = int(ring_index.offsets[low])
+        self.high = (int(ring_index.offsets[high - 1]) +
+                     int(ring_index.counts[high - 1]))
+        self.local = WorldState(state.latitude[self.low:self.high],
+                                state.longitude[self.low:self.high],
+                                state.config)
+        self.local.neighbors = [
+            [n - self.low for n in neighbors if self.low <= n < self.high]
+            for neighbors in state.neighbors[self.low:self.high]]
+
+    def exchange_halo(self):
+        """Copy the band's cells and its halo from the shared arrays."""
+        for field in shared_fields:
+            getattr(self.local, field)[:] = \
+                getattr(self.state, field)[self.low:self.high]
+
+    def run_phase(self, name, config):
+        """Run the phase called name on the band's cells, with config."""
+        self.own.config = config
+        self.local.config = config
+        if name in edge_phases:
+            getattr(self.local, edge_phases[name])()
+            owned = slice(self.start - self.low, self.stop - self.low)
+            for field in edge_fields:
+                getattr(self.own, field)[:] = getattr(self.local, field)[owned]
+        elif name == "transfer_energy_vertically":
+            self.own.transfer_energy_vertically()
+        elif name == "absorb_energy_from_core":
+            self.own.absorb_energy_from_core(config.core_energy)
+        elif name == "absorb_energy_from_sun":
+            self.own.absorb_energy_from_sun(config.max_solar_energy)
+
+
+def run_band(connection, state, ring_index, first, last):
+    """Run the commands Bands sends to a band, in its worker process.
+
+    Replies to each command with None, or the traceback if it fails.
+    """
+    band = Band(state, ring_index, first, last)
+    while True:
+        name, args = connection.recv()
+        if name is None:
+            return
+        try:
+            getattr(band, name)(*args)
+            connection.send(None)
+        except Exception:
+            connection.send(traceback.format_exc())
+
+
+def band_rings(counts, bands):
+    """Split rings holding counts cells each into bands of whole rings.
+
+    The bands hold about the same number of cells. Returns the first ring of
+    each band and then the number of rings, so band b is rings[b] to
+    rings[b + 1] - 1.
+    """
+    if not 1 <= bands <= len(counts):
+        raise ValueError("cannot split {} rings into {} bands".format(
+            len(counts), bands))
+    ends = np.cumsum(counts)
+    rings = [0]
+    for b in range(1, bands):
+        ring = int(np.abs(ends - ends[-1]*b/float(bands)).argmin()) + 1
+        # leave at least a ring for each band still to come
+        rings.append(min(max(ring, rings[-1] + 1), len(counts) - bands + b))
+    rings.append(len(counts))
+    return rings
+
+
+def shared_copy(array):
+    """A copy of a float array, in memory shared with child processes."""
+    shared = np.frombuffer(multiprocessing.RawArray("d", len(array)))
+    shared[:] = array
+    return shared
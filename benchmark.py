@@ -0,0 +1,284 @@
+"""Time how world creation and each step phase scale with world size.
+
+For example:
+
+    python benchmark.py --circumferences 20 40 80 160 --output bench.json
+
+With --bands the bands physics mode is timed too, with each number of
+bands given, and the parallel efficiency of each is reported:
+
+    python benchmark.py --circumferences 160 320 --bands 1 2 4 8
+
+Each combination of circumference and water_init_mode runs in its own
+process, so peak memory is measured per run, along with the bytes each cell
+takes up (see memory_report). Results are written as JSON, including the
+scaling exponent of each stage (the slope of log time against log cells),
+so they can be compared between versions.
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+import time
+import numpy as np
+from cell import Land
+import settings
+from profiling import Profiler
+from simulation import Simulation
+from world import World
+
+creation_stages = ["create_cells", "create_land", "create_terrain",
+                   "normalize_terrain", "create_oceans"]
+
+
+def parse_args(args=None):
+    """Read the command line."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark Eden at several world sizes.")
+    parser.add_argument("--circumferences", type=int, nargs="+",
+                        default=[20, 40, 80],
+                        help="world circumferences (cells) to time")
+    parser.add_argument("--water-init-modes", nargs="+",
+                        choices=["even", "dump"], default=["even", "dump"])
+    parser.add_argument("--physics-mode", choices=["arrays", "cells"],
+                        default=settings.physics_mode)
+    parser.add_argument("--steps", type=int, default=5,
+                        help="steps to time at each size")
+    parser.add_argument("--time-step", type=int,
+                        default=settings.time_step_size,
+                        help="length of each step (s)")
+    parser.add_argument("--bands", type=int, nargs="+", default=[],
+                        help="numbers of bands to time the bands physics "
+                             "mode with")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None,
+                        help="write the results here instead of stdout")
+    return parser.parse_args(args)
+
+
+def timed(function, *args):
+    """Run function and return how long it took (s)."""
+    start = time.time()
+    function(*args)
+    return time.time() - start
+
+
+def benchmark(values, steps, seed):
+    """Time one world built with the settings in values.
+
+    Returns the timings as a dict.
+    """
+    settings.update(verbose=False, **values)
+    random.seed(seed)
+
+    world = World(build=False)
+    creation = dict((stage, timed(getattr(world, stage)))
+                    for stage in creation_stages)
+    simulation = Simulation(world=world)
+    cells = len(world.cells)
+    if settings.physics_mode == "bands":
+        # start the band processes before the clock does
+        world.bands()
+
+    profiler = Profiler(simulation)
+    profiler.start()
+    start = time.time()
+    for _ in range(steps):
+        simulation.step()
+    stepping = time.time() - start
+    profiler.stop()
+    world.close()
+
+    result = dict(values)
+    result.update({
+        "cells": cells,
+        "edges": len(world.state.edges()[0]),
+        "creation_seconds": creation,
+        "cells_per_second": cells/sum(creation.values()),
+        "step_seconds": dict((name, t/steps) for name, t
+                             in profiler.phase_seconds.items()),
+        "steps_per_second": steps/stepping,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_memory_mb":
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0,
+        "bytes_per_cell": memory_report(world)
+    })
+    return result
+
+
+def memory_report(world):
+    """The bytes each cell of world takes up, by part, as a dict.
+
+    "cells" is the Cell objects with both their Land and Water views made,
+    "neighbors" the neighbor lists of the cells (and of the state, if it
+    has made them) and "arrays" the arrays of the state, including its
+    neighbor arrays, and of its column kernel. Objects shared between
+    cells, such as small ints, are counted once for each cell using them.
+    """
+    state = world.state
+    view_bytes = sys.getsizeof(Land(state, 0))
+    cells = sys.getsizeof(world.cells) + sum(
+        object_bytes(c) + 2*view_bytes for c in world.cells)
+    neighbors = sum(sys.getsizeof(c.neighbors) for c in world.cells)
+    if state._neighbors is not None:
+        neighbors += sys.getsizeof(state.neighbors) + sum(
+            sys.getsizeof(n) + sum(sys.getsizeof(i) for i in n)
+            for n in state.neighbors)
+    arrays = array_bytes(state)
+    if state._column_kernel is not None:
+        arrays += array_bytes(state._column_kernel)
+
+    n = float(len(world.cells))
+    report = {"cells": cells/n, "neighbors": neighbors/n, "arrays": arrays/n}
+    report["total"] = sum(report.values())
+    return report
+
+
+def object_bytes(o):
+    """The bytes o takes up, with its __dict__ if it has one."""
+    size = sys.getsizeof(o)
+    if hasattr(o, "__dict__"):
+        size += sys.getsizeof(o.__dict__)
+    return size
+
+
+def array_bytes(o):
+    """The bytes of data in the arrays (or tuples of arrays) o holds."""
+    size = 0
+    for value in vars(o).values():
+        for array in value if isinstance(value, tuple) else [value]:
+            if isinstance(array, np.ndarray):
+                size += array.nbytes
+    return size
+
+
+def run_benchmark(queue, values, steps, seed):
+    """Run benchmark in this process and put the result on queue."""
+    queue.put(benchmark(values, steps, seed))
+
+
+def benchmark_in_child(values, steps, seed):
+    """Run benchmark in a fresh process, so its peak memory is its own."""
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=run_benchmark, args=(queue, values, steps, seed))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def scaling_exponent(cells, seconds):
+    """The least squares slope of log(seconds) against log(cells)."""
+    points = [(math.log(n), math.log(t))
+              for n, t in zip(cells, seconds) if t > 0]
+    if len(points) < 2:
+        return None
+    x, y = zip(*points)
+    return np.polyfit(x, y, 1)[0]
+
+
+def scaling(results):
+    """Scaling exponents of each stage, per water_init_mode."""
+    exponents = {}
+    for mode in sorted(set(r["water_init_mode"] for r in results)):
+        runs = [r for r in results if r["water_init_mode"] == mode]
+        cells = [r["cells"] for r in runs]
+        stages = {}
+        for stage in creation_stages:
+            stages[stage] = scaling_exponent(
+                cells, [r["creation_seconds"][stage] for r in runs])
+        # long steps time a group as a whole (see Simulation.run_phases)
+        for phase in set().union(*[r["step_seconds"] for r in runs]):
+            stages[phase] = scaling_exponent(
+                cells, [r["step_seconds"].get(phase, 0.0) for r in runs])
+        exponents[mode] = stages
+    return exponents
+
+
+def band_efficiency(results):
+    """The parallel efficiency of the bands physics mode.
+
+    Returns a dict for each water_init_mode, holding a dict for each
+    circumference of the efficiency with each number of bands. That is the
+    speed-up in steps per second over the fewest bands timed, divided by
+    how many times more bands there are, so 1 is perfect scaling.
+    """
+    efficiency = {}
+    for mode in sorted(set(r["water_init_mode"] for r in results)):
+        efficiency[mode] = {}
+        for circumference in sorted(set(r["world_cell_circumference"]
+                                        for r in results)):
+            runs = sorted([r for r in results
+                           if r["water_init_mode"] == mode and
+                           r["world_cell_circumference"] == circumference],
+                          key=lambda r: r["bands"])
+            base = runs[0]
+            efficiency[mode][circumference] = dict(
+                (r["bands"], (r["steps_per_second"] /
+                              base["steps_per_second"]) /
+                 (r["bands"]/float(base["bands"])))
+                for r in runs)
+    return efficiency
+
+
+def main(args=None):
+    """Run the benchmarks the command line asks for."""
+    args = parse_args(args)
+    results = []
+    for mode in args.water_init_modes:
+        for circumference in args.circumferences:
+            values = {"world_cell_circumference": circumference,
+                      "water_init_mode": mode,
+                      "physics_mode": args.physics_mode,
+                      "time_step_size": args.time_step}
+            result = benchmark_in_child(values, args.steps, args.seed)
+            sys.stderr.write(
+                "{water_init_mode} {world_cell_circumference}: {cells} "
+                "cells, {steps_per_second:.2f} steps/s, {bytes:.0f} bytes "
+                "per cell\n".format(bytes=result["bytes_per_cell"]["total"],
+                                    **result))
+            results.append(result)
+
+    band_results = []
+    for mode in args.water_init_modes:
+        for circumference in args.circumferences:
+            for bands in args.bands:
+                values = {"world_cell_circumference": circumference,
+                          "water_init_mode": mode,
+                          "physics_mode": "bands",
+                          "bands": bands,
+                          "time_step_size": args.time_step}
+                result = benchmark_in_child(values, args.steps, args.seed)
+                sys.stderr.write(
+                    "{water_init_mode} {world_cell_circumference} in "
+                    "{bands} bands: {steps_per_second:.2f} steps/s\n"
+                    .format(**result))
+                band_results.append(result)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "steps": args.steps,
+        "results": results,
+        "scaling_exponents": scaling(results)
+    }
+    if band_results:
+        report["band_results"] = band_results
+        report["band_efficiency"] = band_efficiency(band_results)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print text
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
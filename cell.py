@@ -1,24 +1,64 @@
 """Cells and their constituent classes."""
 
-import settings
 import math
 
 
-class Cell():
+class Cell(object):
     """The repeated unit that makes up a world.
 
     Cells have land and water and can be though of as a single column on
-    the world's surface.
+    the world's surface. A cell is a view onto element index of the world's
+    WorldState, which holds the actual values. There can be hundreds of
+    thousands of cells, so they have __slots__ rather than a __dict__, and
+    their Land and Water views are only made when first used.
     """
 
-    def __init__(self, latitude, longitude):
+    __slots__ = ("state", "index", "neighbors", "_land", "_water")
+
+    def __init__(self, state, index):
         """Make a cell."""
-        self.latitude = latitude
-        self.longitude = longitude
-        self.facing_sun = math.sin(math.radians(self.latitude))
-        self.land = Land(self)
-        self.water = Water(self)
+        self.state = state
+        self.index = index
         self.neighbors = []
+        self._land = None
+        self._water = None
+
+    @property
+    def land(self):
+        """The land of the cell."""
+        if self._land is None:
+            self._land = Land(self.state, self.index)
+        return self._land
+
+    @property
+    def water(self):
+        """The water of the cell."""
+        if self._water is None:
+            self._water = Water(self.state, self.index)
+        return self._water
+
+    @property
+    def latitude(self):
+        """The latitude of the cell (degrees)."""
+        return self.state.latitude[self.index]
+
+    @latitude.setter
+    def latitude(self, value):
+        self.state.latitude[self.index] = value
+
+    @property
+    def longitude(self):
+        """The longitude of the cell (degrees)."""
+        return self.state.longitude[self.index]
+
+    @longitude.setter
+    def longitude(self, value):
+        self.state.longitude[self.index] = value
+
+    @property
+    def facing_sun(self):
+        """How directly the cell faces the sun (0 to 1)."""
+        return self.state.facing_sun[self.index]
 
     def add_material(self, material, mass, temperature):
         """Add some material to a cell."""
@@ -44,30 +84,40 @@ class Cell():
         # land radiates energy
         lost_land_energy = self.land.radiate_energy()
         if self.water.mass > 0:
-            lost_water_energy = self.water.radiate_energy()
-            self.water.radiate_energy()
+            # water absorbs some of what the land radiated, then radiates
+            # up and down, and the land absorbs what went down. Absorbing
+            # first, and splitting what it radiates evenly, keeps thin
+            # water, which radiates nearly all it has in a step, from
+            # handing the land back what the land radiated
             self.water.absorb_infrared_energy(lost_land_energy)
-            self.land.absorb_energy(lost_water_energy)
+            lost_water_energy = (self.water.radiate_energy() +
+                                 self.water.radiate_energy())
+            self.land.absorb_energy(lost_water_energy/2)
 
     def conduct_energy_vertically(self):
         """Conduct energy between land/water/air."""
         # land conducts to water
         if self.water.mass > 0:
-            self.land.conduct_energy(to=self.water, area=settings.cell_area)
-            self.water.conduct_energy(to=self.land, area=settings.cell_area)
+            config = self.state.config
+            self.land.conduct_energy(to=self.water,
+                                     conduction=config.land_column_conduction)
+            self.water.conduct_energy(
+                to=self.land, conduction=config.water_column_conduction)
 
     def conduct_energy_horizontally(self):
         """Conduct energy between neighbors."""
+        config = self.state.config
         for n in self.neighbors:
             self.land.conduct_energy(
-                to=n.land, area=settings.cell_width*settings.land_depth
+                to=n.land, conduction=config.land_edge_conduction
             )
         if self.water.mass > 0:
             for n in self.neighbors:
                 if n.water.mass > 0:
                     mean_depth = (self.water.depth + n.water.depth)/2
                     self.water.conduct_energy(
-                        to=n.water, area=mean_depth*settings.cell_area
+                        to=n.water,
+                        conduction=mean_depth*config.water_edge_conduction
                     )
 
     @property
@@ -84,18 +134,45 @@ class Cell():
             return self.land.temperature
 
 
+def state_field(name):
+    """A property that reads and writes the named WorldState array.
+
+    The array is taken from the material's state, at the material's index.
+    """
+    def get(self):
+        return getattr(self.state, name)[self.index]
+
+    def set(self, value):
+        getattr(self.state, name)[self.index] = value
+
+    return property(get, set)
+
+
+def config_field(name):
+    """A property that reads the named value of the material's Config."""
+    def get(self):
+        return getattr(self.state.config, name)
+
+    return property(get)
+
+
 class Material(object):
-    """An abstract class for physical materials."""
+    """An abstract class for physical materials.
+
+    A material is a view onto element index of a WorldState, like the cell
+    it belongs to. Constants such as specific_heat_capacity are class-level
+    properties that read the state's Config, so no material holds a copy.
+    """
 
-    def __init__(self, cell):
+    __slots__ = ("state", "index")
+
+    albedo = None
+    cell_area = config_field("cell_area")
+
+    def __init__(self, state, index):
         """Create some material."""
-        self.cell = cell
-        self.mass = 0.0
-        self.thermal_energy = 0.0
-        self.specific_heat_capacity = None
-        self.density = None
-        self.albedo = None
-        self.emissivity = None
+        self.state = state
+        self.index = index
 
     @property
     def temperature(self):
@@ -114,7 +191,7 @@ class Material(object):
     @property
     def depth(self):
         """The depth of the material."""
-        return self.volume / settings.cell_area
+        return self.volume / self.cell_area
 
     def change_mass(self, mass, temperature):
         """Change the mass of the material."""
@@ -139,21 +216,21 @@ class Material(object):
         """Radiate energy into space."""
         if self.thermal_energy > 0 and self.mass > 0:
             initial_energy = self.thermal_energy
-            top = 3 * (settings.tv.stefan_boltzmann_constant *
-                       settings.cell_area * self.emissivity *
-                       settings.time_step_size)
             bottom = (pow(self.mass, 4) *
                       pow(self.specific_heat_capacity, 4))
-            Z = top/bottom
+            Z = self.radiation/bottom
             self.thermal_energy = pow(Z + pow(self.thermal_energy, -3),
                                       -1.0/3.0)
             return initial_energy - self.thermal_energy
         else:
             return 0
 
-    def conduct_energy(self, to, area):
+    def conduct_energy(self, to, conduction):
         """Conduct energy between materials.
 
+        conduction is the thermal conductivity times the contact area times
+        the time step (J/K), as worked out in the Config.
+
         See thermal energy formula for derivation.
         It is actually based on the laws for thermal
         eergy transfer via convection, but assumes the
@@ -162,24 +239,17 @@ class Material(object):
         target = to
 
         if self.temperature > target.temperature:
-            E0 = self.thermal_energy
-            E = E0 + target.thermal_energy
-            m0 = self.mass
-            c0 = self.specific_heat_capacity
-            m1 = target.mass
-            c1 = target.specific_heat_capacity
-            k = self.thermal_conductivity
-            time = settings.time_step_size
-
-            energy_loss = E0 - (
-                ((E * m0 * c0) / (m1 * c1 + m0 * c0)) +
-                (E0 - (
-                    (E * m0 * c0) /
-                    (m1 * c1 + m0 * c0)
-                )) * math.exp(
-                    (-k * area * (m1 * c1 + m0 * c0) * time) /
-                    (m0 * c0 * m1 * c1)
-                )
+            mc0 = self.mass * self.specific_heat_capacity
+            mc1 = target.mass * target.specific_heat_capacity
+
+            # the energy that would bring both to the same temperature,
+            # times the fraction of the way there they get. It is worked
+            # out from the difference in temperature: the difference of
+            # two energies loses precision when one material is far heavier
+            energy_loss = (
+                mc0 * mc1 / (mc0 + mc1) *
+                (self.temperature - target.temperature) *
+                -math.expm1((-conduction * (mc0 + mc1)) / (mc0 * mc1))
             )
 
             self.thermal_energy -= energy_loss
@@ -189,47 +259,57 @@ class Material(object):
 class Land(Material):
     """The terrain of a cell."""
 
-    def __init__(self, cell):
-        """Make some land."""
-        super(Land, self).__init__(cell)
-        self.specific_heat_capacity = settings.land_specific_heat_capacity
-        self.density = settings.land_density
-        self.height = 0.0
-        self.albedo = settings.land_albedo
-        self.emissivity = settings.land_emissivity
-        self.thermal_conductivity = settings.land_thermal_conductivity
+    __slots__ = ()
+
+    mass = state_field("land_mass")
+    thermal_energy = state_field("land_energy")
+    specific_heat_capacity = config_field("land_specific_heat_capacity")
+    density = config_field("land_density")
+    albedo = config_field("land_albedo")
+    emissivity = config_field("land_emissivity")
+    thermal_conductivity = config_field("land_thermal_conductivity")
+    radiation = config_field("land_radiation")
+
+    @property
+    def height(self):
+        """The height of the land."""
+        return self.state.land_height[self.index]
+
+    @height.setter
+    def height(self, value):
+        self.state.land_height[self.index] = value
 
 
 class Water(Material):
     """The water of a cell."""
 
-    def __init__(self, cell):
-        """Create some water."""
-        super(Water, self).__init__(cell)
-        self.specific_heat_capacity = settings.water_specific_heat_capacity
-        self.density = settings.water_density
-        self.albedo = settings.water_albedo(self.cell.facing_sun)
-        self.attenuation_coefficient_sunlight =\
-            settings.water_attenuation_coefficient_sunlight
-        self.attenuation_coefficient_infrared =\
-            settings.water_attenuation_coefficient_infrared
-        self.emissivity = settings.water_emissivity
-        self.thermal_conductivity = settings.water_thermal_conductivity
+    __slots__ = ()
+
+    mass = state_field("water_mass")
+    thermal_energy = state_field("water_energy")
+    albedo = state_field("water_albedo")
+    specific_heat_capacity = config_field("water_specific_heat_capacity")
+    density = config_field("water_density")
+    attenuation_coefficient_sunlight = config_field(
+        "water_attenuation_coefficient_sunlight")
+    attenuation_coefficient_infrared = config_field(
+        "water_attenuation_coefficient_infrared")
+    emissivity = config_field("water_emissivity")
+    thermal_conductivity = config_field("water_thermal_conductivity")
+    radiation = config_field("water_radiation")
 
     def absorb_solar_energy(self, energy):
         """Absorb sunlight."""
-        energy_absorbed =\
-            (1 - math.exp(-self.attenuation_coefficient_sunlight *
-                          self.depth))*energy
+        energy_absorbed = -math.expm1(
+            -self.attenuation_coefficient_sunlight*self.depth)*energy
         self.thermal_energy += energy_absorbed
         energy_remaining = energy - energy_absorbed
         return [energy_absorbed, energy_remaining]
 
     def absorb_infrared_energy(self, energy):
         """Absorb sunlight."""
-        energy_absorbed =\
-            (1 - math.exp(-self.attenuation_coefficient_infrared *
-                          self.depth))*energy
+        energy_absorbed = -math.expm1(
+            -self.attenuation_coefficient_infrared*self.depth)*energy
         self.thermal_energy += energy_absorbed
         energy_remaining = energy - energy_absorbed
         return [energy_absorbed, energy_remaining]
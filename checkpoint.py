@@ -0,0 +1,108 @@
+"""Saving and restoring simulations.
+
+A checkpoint holds everything needed to carry on a simulation: the cells'
+coordinates, the neighbor graph, the land and water in each cell, the
+simulated time, the settings the physics runs with (its Config) and the
+state of the random number generator. It is an array file (see
+array_file.py), so its arrays can be memory-mapped when the checkpoint is
+restored and restoring does not read the whole file.
+"""
+
+import random
+import threading
+from array_file import read_arrays, write_arrays
+from config import Config, physics_settings
+import settings
+from simulation import Simulation
+from world import World
+from world_state import WorldState
+
+# settings a checkpoint restores, as the world depends on them
+saved_settings = ["world_cell_circumference", "world_circumference",
+                  "time_step_description"]
+
+
+def capture(simulation):
+    """Copy the parts of simulation a checkpoint holds.
+
+    Returns the arrays and values to pass to write_arrays. Everything is
+    copied, so the simulation can carry on while they are written.
+    """
+    state = simulation.world.state
+    arrays = dict((field, getattr(state, field).copy())
+                  for field in WorldState.fields)
+    arrays["neighbor_offsets"], arrays["neighbor_indices"] = [
+        array.copy() for array in state.neighbor_arrays()]
+    values = dict((name, getattr(settings, name)) for name in saved_settings)
+    values["config"] = dict((name, getattr(simulation.config, name))
+                            for name in physics_settings)
+    values["kind"] = "checkpoint"
+    values["time"] = simulation.time
+    values["random_state"] = random.getstate()
+    return arrays, values
+
+
+def save(simulation, path):
+    """Save simulation to a checkpoint file at path."""
+    arrays, values = capture(simulation)
+    write_arrays(path, arrays, values)
+
+
+def restore(path, mmap=True):
+    """Restore a simulation from the checkpoint file at path.
+
+    The simulation runs with the Config it was saved with, whatever the
+    settings are now. The settings the world depends on and the random
+    number generator are restored too. If mmap is True the world's arrays
+    are memory-mapped from the file rather than read in.
+    """
+    arrays, values = read_arrays(path, mmap)
+    if values.get("kind") != "checkpoint":
+        raise ValueError("{} is not a checkpoint".format(path))
+    settings.update(**dict((name, values[name]) for name in saved_settings))
+    version, internal_state, gauss_next = values["random_state"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+    config = Config(len(arrays["latitude"]), **values["config"])
+    world = World(build=False)
+    world.use_state(WorldState.from_arrays(
+        arrays, arrays["neighbor_offsets"], arrays["neighbor_indices"],
+        config))
+    simulation = Simulation(world=world)
+    simulation.time = values["time"]
+    return simulation
+
+
+class Checkpointer():
+    """Saves a simulation every so many steps while it runs.
+
+    Files are written by a background thread from a copy of the state, so
+    the step loop only pays for the copy. If the previous checkpoint is
+    still being written when the next is due, the next is skipped.
+    """
+
+    def __init__(self, simulation, path, every):
+        """Checkpoint simulation to path every every steps."""
+        self.simulation = simulation
+        self.path = path
+        self.every = every
+        self.steps = 0
+        self.thread = None
+        simulation.add_step_callback(self.step_finished)
+
+    def step_finished(self, simulation):
+        """Count a step, starting a checkpoint if one is due."""
+        self.steps += 1
+        if self.steps % self.every == 0:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            arrays, values = capture(simulation)
+            self.thread = threading.Thread(
+                target=write_arrays, args=(self.path, arrays, values))
+            self.thread.start()
+
+    def close(self):
+        """Stop checkpointing, waiting for any checkpoint being written."""
+        self.simulation.remove_step_callback(self.step_finished)
+        if self.thread is not None:
+            self.thread.join()
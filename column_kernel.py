@@ -0,0 +1,200 @@
+"""A fused kernel for the physics within each column of the world.
+
+Vertical energy transfer and solar absorption only move energy within a
+cell's own column of land and water, so every cell can be done at once.
+"""
+
+import numpy as np
+
+
+class ColumnKernel():
+    """Vertical energy transfer and solar absorption for all cells at once.
+
+    This does what Cell.radiate_energy_vertically, conduct_energy_vertically
+    and gain_solar_energy do, for every cell of a WorldState. All the work
+    happens in buffers made when the kernel is created, so running it makes
+    no new arrays. Cells a step does not apply to are computed anyway and
+    then left out when the results are copied back. Constants come from the
+    state's Config.
+    """
+
+    def __init__(self, n):
+        """Make a kernel for n cells."""
+        self.lost_land = np.empty(n)
+        self.lost_water = np.empty(n)
+        self.p = np.empty(n)
+        self.q = np.empty(n)
+        self.r = np.empty(n)
+        self.x = np.empty(n)
+        self.y = np.empty(n)
+        self.z = np.empty(n)
+        self.wet = np.empty(n, dtype=bool)
+        self.active = np.empty(n, dtype=bool)
+        self.mask = np.empty(n, dtype=bool)
+
+    def transfer_energy_vertically(self, state):
+        """Transfer energy between land/water/space in every cell."""
+        config = state.config
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            wet = self.wet
+            np.greater(state.water_mass, 0, out=wet)
+
+            # land radiates, water absorbs some of that and then radiates
+            # twice (up and down), and the land absorbs the half that went
+            # down, as in Cell.radiate_energy_vertically
+            self.radiate(state.land_energy, state.land_mass,
+                         config.land_specific_heat_capacity,
+                         config.land_radiation, None, self.lost_land)
+            fraction = self.absorbed_fraction(
+                state, config.infrared_attenuation, self.p)
+            fraction *= self.lost_land
+            np.add(state.water_energy, fraction, out=state.water_energy,
+                   where=wet)
+            self.radiate(state.water_energy, state.water_mass,
+                         config.water_specific_heat_capacity,
+                         config.water_radiation, wet, self.lost_water,
+                         twice=True)
+            np.add(state.land_energy, self.lost_water, out=state.land_energy,
+                   where=wet)
+
+            # land conducts to water, then water conducts to land
+            self.conduct(state.land_energy, state.land_mass,
+                         config.land_specific_heat_capacity,
+                         state.water_energy, state.water_mass,
+                         config.water_specific_heat_capacity,
+                         config.land_column_conduction, wet)
+            self.conduct(state.water_energy, state.water_mass,
+                         config.water_specific_heat_capacity,
+                         state.land_energy, state.land_mass,
+                         config.land_specific_heat_capacity,
+                         config.water_column_conduction, wet)
+
+    def absorb_energy_from_sun(self, state, max_E):
+        """Absorb sunlight, given the energy a cell facing the sun gets."""
+        config = state.config
+        wet = self.wet
+        np.greater(state.water_mass, 0, out=wet)
+        energy = self.x
+        np.multiply(state.facing_sun, max_E, out=energy)
+
+        # water reflects some sunlight and absorbs some of the rest
+        reflected = self.y
+        np.multiply(energy, state.water_albedo, out=reflected)
+        np.subtract(energy, reflected, out=energy, where=wet)
+        absorbed = self.absorbed_fraction(
+            state, config.sunlight_attenuation, self.q)
+        absorbed *= energy
+        np.add(state.water_energy, absorbed, out=state.water_energy,
+               where=wet)
+        np.subtract(energy, absorbed, out=energy, where=wet)
+
+        # land reflects some of what is left (some of which the water
+        # absorbs) and absorbs the rest
+        reflected.fill(0.0)
+        np.greater(state.land_mass, 0, out=self.mask)
+        np.multiply(energy, config.land_albedo, out=reflected,
+                    where=self.mask)
+        absorbed = self.absorbed_fraction(
+            state, config.infrared_attenuation, self.q)
+        absorbed *= reflected
+        np.add(state.water_energy, absorbed, out=state.water_energy,
+               where=wet)
+        energy -= reflected
+        state.land_energy += energy
+
+    def absorbed_fraction(self, state, attenuation, out):
+        """The fraction of energy absorbed passing through each cell's water.
+
+        attenuation is per kg of water in a cell, as in the Config. Returns
+        out, which holds the result.
+        """
+        np.multiply(state.water_mass, -attenuation, out=out)
+        np.expm1(out, out=out)
+        np.negative(out, out=out)
+        return out
+
+    def radiate(self, energy, mass, specific_heat_capacity, radiation,
+                where, lost, twice=False):
+        """Radiate energy into space, as Material.radiate_energy does.
+
+        radiation is the material's radiation coefficient from the Config.
+        Only materials with energy and mass radiate, and only those where
+        where is True if it is given. The energy they lose is stored in
+        lost, which is 0 elsewhere. If twice is True they radiate twice
+        over and lost holds half of what they lost.
+
+        Radiating for time t takes energy E to (Z + E^-3)^(-1/3), so
+        doing it twice takes it to (2Z + E^-3)^(-1/3).
+        """
+        active = self.active
+        np.greater(energy, 0, out=active)
+        np.greater(mass, 0, out=self.mask)
+        active &= self.mask
+        if where is not None:
+            active &= where
+
+        z = self.z
+        np.multiply(mass, specific_heat_capacity, out=z)
+        z *= z
+        z *= z
+        np.divide(radiation, z, out=z)
+
+        x = self.x
+        np.multiply(energy, energy, out=x)
+        x *= energy
+        np.reciprocal(x, out=x)
+        x += z
+
+        y = self.y
+        np.cbrt(x, out=y)
+        np.reciprocal(y, out=y)
+        if twice:
+            x += z
+            np.cbrt(x, out=y)
+            np.reciprocal(y, out=y)
+        lost.fill(0.0)
+        np.subtract(energy, y, out=lost, where=active)
+        if twice:
+            lost *= 0.5
+        np.copyto(energy, y, where=active)
+
+    def conduct(self, E0, m0, c0, E1, m1, c1, conduction, where):
+        """Conduct energy from materials 0 to 1 across each cell's area.
+
+        As Material.conduct_energy, conduction is the thermal conductivity
+        times the area times the time step, and energy only flows where
+        material 0 is hotter. It only flows where where is True too.
+        """
+        mc0 = self.p
+        mc1 = self.q
+        np.multiply(m0, c0, out=mc0)
+        np.multiply(m1, c1, out=mc1)
+
+        # where material 0 is hotter
+        t0 = self.x
+        t1 = self.y
+        np.divide(E0, mc0, out=t0)
+        np.divide(E1, mc1, out=t1)
+        np.greater(t0, t1, out=self.active)
+        self.active &= where
+
+        # the energy material 0 would lose reaching equilibrium, from the
+        # temperatures as in Material.conduct_energy...
+        loss = self.x
+        np.subtract(t0, t1, out=loss)
+        total = self.r
+        np.add(mc0, mc1, out=total)
+        fraction = self.y
+        np.multiply(mc0, mc1, out=fraction)
+        loss *= fraction
+        loss /= total
+
+        # ...times the fraction of the way there it gets
+        np.divide(total, fraction, out=fraction)
+        fraction *= -conduction
+        np.expm1(fraction, out=fraction)
+        np.negative(fraction, out=fraction)
+        loss *= fraction
+
+        np.subtract(E0, loss, out=E0, where=self.active)
+        np.add(E1, loss, out=E1, where=self.active)
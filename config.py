@@ -0,0 +1,105 @@
+"""The settings a simulation runs with, frozen."""
+
+import math
+import settings
+import true_values as tv
+
+# the settings a Config copies
+physics_settings = [
+    "time_step_size", "cell_width", "cell_area", "land_depth",
+    "land_density", "water_density",
+    "land_specific_heat_capacity", "water_specific_heat_capacity",
+    "land_thermal_conductivity", "water_thermal_conductivity",
+    "land_emissivity", "water_emissivity", "land_albedo",
+    "water_attenuation_coefficient_sunlight",
+    "water_attenuation_coefficient_infrared",
+    "world_power", "sun_power", "sun_distance"
+]
+
+
+class Config(object):
+    """A frozen copy of the settings the physics uses.
+
+    A simulation reads its settings from its Config rather than from the
+    settings module, so changing settings does not affect a simulation that
+    is running, and simulations made with different settings can run side by
+    side. The coefficients the physics needs that depend only on settings
+    and the time step are worked out once, when the Config is made, rather
+    than on every call. A Config cannot be changed: use with_time_step to
+    make one for another time step.
+    """
+
+    def __init__(self, cells, **values):
+        """Copy the settings, for a world of cells cells.
+
+        values replace the settings of the same names.
+        """
+        for name in physics_settings:
+            self._set(name, values.pop(name, getattr(settings, name)))
+        if values:
+            raise AttributeError("Config has no setting called {}".format(
+                ", ".join(sorted(values))))
+        self._set("cells", cells)
+
+        # conductance (W/K) across an edge between two cells' land, and
+        # between their water per m of mean depth
+        self._set("land_conductance", (self.land_thermal_conductivity *
+                                       self.cell_width * self.land_depth))
+        self._set("water_conductance",
+                  self.water_thermal_conductivity * self.cell_area)
+        # conductance (W/K) between the land and water of a cell
+        self._set("land_column_conductance",
+                  self.land_thermal_conductivity * self.cell_area)
+        self._set("water_column_conductance",
+                  self.water_thermal_conductivity * self.cell_area)
+        # power (W/K^4) a cell's land or water radiates at 1K
+        self._set("land_emission", (tv.stefan_boltzmann_constant *
+                                    self.cell_area * self.land_emissivity))
+        self._set("water_emission", (tv.stefan_boltzmann_constant *
+                                     self.cell_area * self.water_emissivity))
+        # power (W) of the sunlight a cell facing the sun gets and of the
+        # heat each cell gets from the core
+        self._set("solar_power",
+                  self.cell_area / (4 * math.pi * pow(self.sun_distance, 2)) *
+                  self.sun_power)
+        self._set("core_power", float(self.world_power) / cells)
+        # the attenuation of light per kg of water in a cell
+        self._set("sunlight_attenuation",
+                  self.water_attenuation_coefficient_sunlight /
+                  (self.water_density * self.cell_area))
+        self._set("infrared_attenuation",
+                  self.water_attenuation_coefficient_infrared /
+                  (self.water_density * self.cell_area))
+
+        time = self.time_step_size
+        # Z times (mc)^4 in Material.radiate_energy
+        self._set("land_radiation", 3 * (self.land_emission * time))
+        self._set("water_radiation", 3 * (self.water_emission * time))
+        # thermal conductivity times contact area times time (J/K), for
+        # conduction between the land and water of a cell...
+        self._set("land_column_conduction",
+                  self.land_column_conductance * time)
+        self._set("water_column_conduction",
+                  self.water_column_conductance * time)
+        # ...and across an edge (for water, per m of mean depth)
+        self._set("land_edge_conduction", self.land_conductance * time)
+        self._set("water_edge_conduction", self.water_conductance * time)
+        # the sunlight a cell facing the sun gets and the energy each cell
+        # gets from the core, each time step
+        self._set("max_solar_energy", self.solar_power * time)
+        self._set("core_energy", float(self.world_power) * time / cells)
+
+    def _set(self, name, value):
+        """Set an attribute while the Config is being made."""
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        """Refuse to change the Config."""
+        raise AttributeError("a Config cannot be changed")
+
+    def with_time_step(self, time_step_size):
+        """A Config that differs from this one only in its time step."""
+        values = dict((name, getattr(self, name))
+                      for name in physics_settings)
+        values["time_step_size"] = time_step_size
+        return Config(self.cells, **values)
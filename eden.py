@@ -5,15 +5,16 @@ from simulation import Simulation
 from ui import UI
 import utility
 from utility import log
-from operator import attrgetter
 import settings
+from worker import Worker
 
 
 class EdenApp():
     """The EdenApp class is the overall app.
 
-    When it runs it creates two objects:
+    When it runs it creates three objects:
     The simulation, that runs the actual simulation.
+    The worker, that steps the simulation in a background thread.
     The ui, that presents visuals of the simulation on the screen.
     """
 
@@ -25,6 +26,7 @@ class EdenApp():
         utility.log_welcome()
         log("> Creating simulation")
         self.simulation = Simulation()
+        self.worker = Worker(self.simulation)
 
         # create the app
         log("> Creating UI")
@@ -36,9 +38,7 @@ class EdenApp():
         self.ui = UI(self.master, self, self.frame)
 
         self.create_key_bindings()
-
-        self.running = False
-        self.time = 0
+        self.poll()
 
     def create_key_bindings(self):
         """Set up key bindings."""
@@ -63,30 +63,25 @@ class EdenApp():
         self.master.bind('<Down>', downKey)
         self.master.bind('<space>', spaceKey)
 
-    def step(self):
-        """Advance one step in time."""
-        self.time += settings.time_step_size
-        self.ui.update_time_label(self.time)
-        self.simulation.step()
-        self.ui.paint_tiles()
-        self.master.update()
+    def poll(self):
+        """Paint the worker's latest snapshot if it is new, then poll again."""
+        if self.worker.snapshot is not self.ui.snapshot:
+            self.ui.paint_snapshot(self.worker.snapshot)
+        self.master.after(int(1000/settings.max_fps), self.poll)
 
     def rotate_map(self, degrees):
-        """Spin the map."""
-        for c in self.simulation.world.cells:
-            c.longitude += degrees
-            if c.longitude < 0:
-                c.longitude += 360.0
-            elif c.longitude >= 360.0:
-                c.longitude -= 360.0
-
-        self.simulation.world.cells = sorted(
-            self.simulation.world.cells,
-            key=attrgetter("latitude", "longitude"))
-        self.ui.paint_tiles()
+        """Spin the map.
+
+        Only the view turns: the cells keep their longitudes.
+        """
+        self.ui.rotate(degrees)
 
     def change_time_step(self, direction):
-        """Change the time_step_size."""
+        """Change the time step, by swapping the simulation's Config."""
+        self.worker.submit(self.shift_time_step, direction)
+
+    def shift_time_step(self, direction):
+        """Lengthen or shorten the time step, on the worker thread."""
         time_steps = [
             1,
             10,
@@ -127,22 +122,20 @@ class EdenApp():
             "100,000 years",
             "1,000,000 years"
         ]
-        index = time_steps.index(settings.time_step_size)
+        index = time_steps.index(self.simulation.config.time_step_size)
         if direction > 0 and index != len(time_steps) - 1:
-            settings.time_step_size = time_steps[index + 1]
+            self.simulation.set_time_step(time_steps[index + 1])
             settings.time_step_description = step_descriptions[index + 1]
         elif direction < 0 and index != 0:
-            settings.time_step_size = time_steps[index - 1]
+            self.simulation.set_time_step(time_steps[index - 1])
             settings.time_step_description = step_descriptions[index - 1]
-        self.ui.update_time_label(self.time)
 
     def toggle_running(self):
         """Start/stop the simulation."""
-        self.running = not self.running
-        while self.running:
-            self.step()
+        self.worker.toggle_running()
 
 
-root = Tk()
-eden = EdenApp(master=root)
-root.mainloop()
+if __name__ == "__main__":
+    root = Tk()
+    eden = EdenApp(master=root)
+    root.mainloop()
@@ -0,0 +1,188 @@
+"""Run many simulations at once, across a grid of settings and seeds.
+
+For example, to run every combination of two water_init_modes and two
+water masses with three seeds each, on four processes:
+
+    python ensemble.py --steps 100 --processes 4 --set time_step_size=3600 \\
+        --set water_init_mode=even,dump --set world_water_mass=1e21,2e21 \\
+        --seeds 0 1 2
+
+Each simulation runs in a fresh process of a pool, so settings and the
+random number generator never leak from one run to the next, and runs
+spread over every core. The world geometry for each world size is worked
+out once and shared through the geometry cache. Results are written as
+JSON, one entry per run.
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import time
+import settings
+from simulation import Simulation
+from world import World
+
+# the settings the world geometry depends on
+geometry_settings = ["world_cell_circumference", "world_circumference"]
+
+
+def parse_args(args=None):
+    """Read the command line."""
+    parser = argparse.ArgumentParser(
+        description="Run Eden over a grid of settings and seeds.")
+    parser.add_argument("--steps", type=int, required=True,
+                        help="steps to run each simulation for")
+    parser.add_argument("--set", action="append", default=[],
+                        metavar="NAME=VALUE,VALUE...",
+                        help="values of a setting to sweep over")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--sample-every", type=int, default=0,
+                        help="keep diagnostics every this many steps")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="processes to use (default: one per core)")
+    parser.add_argument("--geometry-cache", default=None,
+                        help="cache geometry here (default: a temporary "
+                             "directory)")
+    parser.add_argument("--output", default=None,
+                        help="write the results here instead of stdout")
+    return parser.parse_args(args)
+
+
+def parse_override(text):
+    """Read NAME=VALUE,VALUE... as (name, values).
+
+    Values are read as JSON where they can be, and as strings otherwise.
+    """
+    name, values = text.split("=", 1)
+    parsed = []
+    for value in values.split(","):
+        try:
+            parsed.append(json.loads(value))
+        except ValueError:
+            parsed.append(value)
+    return name, parsed
+
+
+def grid(overrides):
+    """Every combination of the values in overrides, as dicts.
+
+    overrides maps each setting to the list of values to try.
+    """
+    names = sorted(overrides)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[overrides[n] for n in names])]
+
+
+def run_ensemble(overrides, seeds, steps, sample_every=0, processes=None,
+                 geometry_cache_dir=None):
+    """Run a simulation for each combination of overrides and seeds.
+
+    overrides maps settings to lists of values (see grid). Each
+    simulation runs for steps steps in its own process, with at most
+    processes at once. Returns a list with a result (see run_member) for
+    each run, in the order of grid(overrides) then seeds.
+    """
+    members = [(values, seed, steps, sample_every)
+               for values in grid(overrides) for seed in seeds]
+    temporary = geometry_cache_dir is None
+    if temporary:
+        geometry_cache_dir = tempfile.mkdtemp(prefix="eden-geometry-")
+    for member in members:
+        member[0]["geometry_cache_dir"] = geometry_cache_dir
+
+    # a fresh process for every task, so no run sees another's settings
+    pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+    try:
+        geometries = set(tuple((name, values[name])
+                               for name in geometry_settings
+                               if name in values)
+                         for values, _, _, _ in members)
+        pool.map(build_geometry,
+                 [dict(g, geometry_cache_dir=geometry_cache_dir)
+                  for g in geometries], chunksize=1)
+
+        results = []
+        for result in pool.imap(run_member, members, chunksize=1):
+            sys.stderr.write("{} of {} runs done\n".format(
+                len(results) + 1, len(members)))
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+        if temporary:
+            shutil.rmtree(geometry_cache_dir, ignore_errors=True)
+    return results
+
+
+def build_geometry(values):
+    """Work out and cache the geometry of a world with the given settings."""
+    settings.update(verbose=False, **values)
+    World(build=False).create_cells()
+
+
+def run_member(member):
+    """Run one simulation, in a pool process.
+
+    member is (values, seed, steps, sample_every): the settings to use, the
+    random seed, the steps to run and how often to keep diagnostics (0
+    for only at the end). Returns a dict of the settings, the seed, the
+    final diagnostics, the samples and how long the run took.
+    """
+    values, seed, steps, sample_every = member
+    settings.update(verbose=False, **values)
+    random.seed(seed)
+
+    start = time.time()
+    simulation = Simulation()
+    built = time.time()
+    samples = []
+    for step in range(1, steps + 1):
+        simulation.step()
+        if sample_every and step % sample_every == 0:
+            sample = simulation.world.state.diagnostics()
+            sample["step"] = step
+            samples.append(sample)
+    finished = time.time()
+
+    settings_used = dict(values)
+    del settings_used["geometry_cache_dir"]
+    return {
+        "settings": settings_used,
+        "seed": seed,
+        "steps": steps,
+        "simulated_time": simulation.time,
+        "diagnostics": simulation.world.state.diagnostics(),
+        "samples": samples,
+        "build_seconds": built - start,
+        "run_seconds": finished - built
+    }
+
+
+def main(args=None):
+    """Run the ensemble the command line asks for."""
+    args = parse_args(args)
+    overrides = dict(parse_override(text) for text in args.set)
+    start = time.time()
+    results = run_ensemble(overrides, args.seeds, args.steps,
+                           args.sample_every, args.processes,
+                           args.geometry_cache)
+    report = {
+        "processes": args.processes or multiprocessing.cpu_count(),
+        "seconds": time.time() - start,
+        "runs": results
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print text
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
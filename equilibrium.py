@@ -0,0 +1,174 @@
+"""Finding the temperatures at which a world is in thermal equilibrium.
+
+The sun, the core and the albedos do not change, so a world settles towards
+temperatures at which every cell's land and water lose energy as fast as
+they gain it. Stepping there takes a very long time. solve works out those
+temperatures directly, for the world's current land and water.
+
+In equilibrium the power into each cell's land and water is 0. The land
+gets sunlight, heat from the core and the half of what the water radiates
+that goes down (see Cell.radiate_energy_vertically). It loses what it
+radiates and what it conducts to the water and to neighboring land. The
+water gets sunlight, the part of the land's radiation it absorbs and heat
+conducted from the land. It loses what it radiates (twice over, up and
+down, as in a step) and what it conducts to neighboring water. Conduction
+between two materials carries k*area times their difference in
+temperature, as Material.conduct_energy does over a short time.
+
+Radiation makes the balance nonlinear, so it is solved by Newton's method.
+Each iteration takes a Newton step for the land with the water held, then
+one for the water with the land held. Each of those is a linear system of
+the radiation and column conduction terms (a diagonal) plus conduction
+between neighbors (a graph Laplacian). That matrix is symmetric and
+positive definite, so it is solved by conjugate gradients.
+"""
+
+import numpy as np
+import settings
+
+
+def solve(state):
+    """The equilibrium temperatures of the land and water of state.
+
+    Returns the land and water temperature of each cell (water is 0 where
+    there is none), starting from the state's temperatures. Raises a
+    ValueError if no iteration changes a temperature by less than
+    settings.equilibrium_tolerance (K) within
+    settings.equilibrium_iterations iterations.
+    """
+    config = state.config
+    n = len(state)
+    wet = state.water_mass > 0
+
+    # conductance across each edge, for land and then water
+    land_a, land_b = state.edges()
+    wet_edges = wet[land_a] & wet[land_b]
+    water_a, water_b = land_a[wet_edges], land_b[wet_edges]
+    depth = state.water_depth
+    water_conductance = ((depth[water_a] + depth[water_b])/2 *
+                         config.water_conductance)
+    land_conductance = np.repeat(float(config.land_conductance), len(land_a))
+
+    land_power, water_power = absorbed_sunlight(state)
+    land_power += config.core_power
+    # the fraction of what the land radiates that its water absorbs
+    infrared = -np.expm1(-config.infrared_attenuation * state.water_mass)
+
+    land_t = state.land_temperature
+    water_t = np.where(wet, state.water_temperature, 0.0)
+    for _ in range(settings.equilibrium_iterations):
+        # the land, with the water held
+        conductance = column_conductance(config, land_t, water_t, wet)
+        residual = (land_power +
+                    np.where(wet, config.water_emission*water_t**4, 0.0) -
+                    config.land_emission*land_t**4 -
+                    conductance*(land_t - water_t) -
+                    laplacian(land_t, land_a, land_b, land_conductance))
+        diagonal = 4*config.land_emission*land_t**3 + conductance
+        land_step = conjugate_gradients(diagonal, land_a, land_b,
+                                        land_conductance, residual)
+        land_t = np.maximum(land_t + land_step, land_t/2)
+
+        # the water, with the land held
+        conductance = column_conductance(config, land_t, water_t, wet)
+        residual = np.where(
+            wet,
+            water_power + infrared*config.land_emission*land_t**4 -
+            2*config.water_emission*water_t**4 +
+            conductance*(land_t - water_t) -
+            laplacian(water_t, water_a, water_b, water_conductance),
+            0.0)
+        diagonal = np.where(
+            wet, 8*config.water_emission*water_t**3 + conductance, 1.0)
+        water_step = conjugate_gradients(diagonal, water_a, water_b,
+                                         water_conductance, residual)
+        water_t = np.where(wet, np.maximum(water_t + water_step, water_t/2),
+                           0.0)
+
+        change = max(np.abs(land_step).max() if n else 0.0,
+                     np.abs(water_step[wet]).max() if wet.any() else 0.0)
+        if change < settings.equilibrium_tolerance:
+            return land_t, water_t
+    raise ValueError("no equilibrium found in {} iterations".format(
+        settings.equilibrium_iterations))
+
+
+def equilibrate(state):
+    """Set the land and water of state to their equilibrium temperatures."""
+    land_t, water_t = solve(state)
+    config = state.config
+    state.land_energy[:] = (land_t * state.land_mass *
+                            config.land_specific_heat_capacity)
+    state.water_energy[:] = (water_t * state.water_mass *
+                             config.water_specific_heat_capacity)
+
+
+def absorbed_sunlight(state):
+    """The power (W) of sunlight each cell's land and water absorb.
+
+    Sunlight is split as in ColumnKernel.absorb_energy_from_sun.
+    """
+    config = state.config
+    wet = state.water_mass > 0
+    energy = state.facing_sun * config.solar_power
+    energy = np.where(wet, energy - energy*state.water_albedo, energy)
+    sunlight = -np.expm1(-config.sunlight_attenuation * state.water_mass)
+    water = sunlight*energy
+    energy = energy - water
+    reflected = np.where(state.land_mass > 0, energy*config.land_albedo, 0.0)
+    water += -np.expm1(-config.infrared_attenuation *
+                       state.water_mass) * reflected
+    return energy - reflected, water
+
+
+def column_conductance(config, land_t, water_t, wet):
+    """The conductance (W/K) between each cell's land and water.
+
+    Heat flows from land to water at the land's conductivity and from water
+    to land at the water's, as in Cell.conduct_energy_vertically. It is 0
+    where there is no water.
+    """
+    return np.where(wet, np.where(land_t > water_t,
+                                  config.land_column_conductance,
+                                  config.water_column_conductance), 0.0)
+
+
+def laplacian(t, a, b, conductance):
+    """The power (W) each cell conducts to its neighbors at temperatures t.
+
+    Edge e joins cells a[e] and b[e] with conductance conductance[e].
+    """
+    flow = conductance * (t[a] - t[b])
+    return (np.bincount(a, flow, minlength=len(t)) -
+            np.bincount(b, flow, minlength=len(t)))
+
+
+def conjugate_gradients(diagonal, a, b, conductance, rhs, tolerance=1e-12):
+    """Solve (D + L)x = rhs for x, by preconditioned conjugate gradients.
+
+    D is the diagonal matrix of diagonal, which must be positive, and L the
+    Laplacian of the edges a, b with conductance conductance (see
+    laplacian). Each iteration is preconditioned by the diagonal of D + L.
+    Stops once the residual is tolerance times rhs, or after as many
+    iterations as there are cells.
+    """
+    n = len(rhs)
+    preconditioner = 1/(diagonal + np.bincount(a, conductance, minlength=n) +
+                        np.bincount(b, conductance, minlength=n))
+    x = np.zeros(n)
+    r = rhs.copy()
+    z = preconditioner*r
+    p = z.copy()
+    rz = r.dot(z)
+    target = tolerance*np.sqrt(rhs.dot(rhs))
+    for _ in range(n):
+        if np.sqrt(r.dot(r)) <= target:
+            break
+        q = diagonal*p + laplacian(p, a, b, conductance)
+        alpha = rz/p.dot(q)
+        x += alpha*p
+        r -= alpha*q
+        z = preconditioner*r
+        rz, previous = r.dot(z), rz
+        p = z + (rz/previous)*p
+    return x
@@ -0,0 +1,65 @@
+"""An on-disk cache of world geometry.
+
+The cells' coordinates, the rings they form and who neighbors whom depend
+only on a few settings, so they can be worked out once and reused. Set
+settings.geometry_cache_dir to a directory to turn the cache on. Each
+combination of the settings gets its own file, named by a hash of them, so
+changing the settings never picks up stale geometry.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+from array_file import read_arrays, write_arrays
+import settings
+
+# bump this when the way geometry is worked out changes
+version = 1
+
+
+def key():
+    """A hash of everything the geometry depends on."""
+    values = [version, settings.world_cell_circumference,
+              repr(settings.world_radius), repr(settings.cell_width)]
+    return hashlib.sha1(json.dumps(values)).hexdigest()
+
+
+def path():
+    """Where the geometry for the current settings is cached."""
+    return os.path.join(settings.geometry_cache_dir,
+                        "geometry-{}.eden".format(key()))
+
+
+def load():
+    """The cached geometry for the current settings, or None.
+
+    Geometry is returned as a dict of arrays, as passed to store.
+    """
+    try:
+        arrays, values = read_arrays(path(), mmap=False)
+    except (IOError, ValueError):
+        return None
+    if values.get("kind") != "geometry" or values.get("key") != key():
+        return None
+    return arrays
+
+
+def store(latitudes, longitudes, ring_index, neighbor_offsets,
+          neighbor_indices):
+    """Cache geometry for the current settings.
+
+    ring_index is the cells' RingIndex and the neighbors are given as by
+    WorldState.neighbor_arrays.
+    """
+    if not os.path.isdir(settings.geometry_cache_dir):
+        os.makedirs(settings.geometry_cache_dir)
+    arrays = {
+        "latitude": np.asarray(latitudes, dtype=float),
+        "longitude": np.asarray(longitudes, dtype=float),
+        "ring_starts": ring_index.offsets,
+        "ring_counts": ring_index.counts,
+        "neighbor_offsets": neighbor_offsets,
+        "neighbor_indices": neighbor_indices
+    }
+    write_arrays(path(), arrays, {"kind": "geometry", "key": key()})
@@ -0,0 +1,171 @@
+"""Run the simulation without a display.
+
+For example, to run 1000 steps of an hour each, saving a checkpoint every
+100 steps, and then to carry on from the last checkpoint:
+
+    python headless.py --steps 1000 --time-step 3600 \\
+        --checkpoint eden.ckpt --checkpoint-every 100
+    python headless.py --steps 1000 --restore eden.ckpt
+
+Progress is logged to stderr and a summary of the run is printed to stdout
+(or written to --output) as JSON.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import checkpoint
+from checkpoint import Checkpointer
+import settings
+from profiling import Profiler
+from recorder import Recorder
+from simulation import Simulation
+
+
+def parse_args(args=None):
+    """Read the command line."""
+    parser = argparse.ArgumentParser(
+        description="Run the Eden simulation without a display.")
+    parser.add_argument("--steps", type=int, required=True,
+                        help="number of steps to run")
+    parser.add_argument("--time-step", type=int, default=None,
+                        help="length of each step (s)")
+    parser.add_argument("--circumference", type=int, default=None,
+                        help="world circumference (cells)")
+    parser.add_argument("--water-init-mode", choices=["even", "dump"],
+                        default=settings.water_init_mode)
+    parser.add_argument("--equilibrate", action="store_true",
+                        help="start from thermal equilibrium, worked out "
+                             "after building or restoring the world")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for the random number generator")
+    parser.add_argument("--restore", default=None,
+                        help="carry on from this checkpoint file")
+    parser.add_argument("--checkpoint", default=None,
+                        help="save checkpoints to this file")
+    parser.add_argument("--checkpoint-every", type=int, default=0,
+                        help="steps between checkpoints (default: only "
+                             "at the end)")
+    parser.add_argument("--record", default=None,
+                        help="record diagnostics into this directory")
+    parser.add_argument("--record-every", type=int, default=1,
+                        help="steps between records")
+    parser.add_argument("--record-resolutions", type=int, nargs="+",
+                        default=[1, 100, 10000],
+                        help="records summarized by each row, for each "
+                             "resolution recorded")
+    parser.add_argument("--report-every", type=int, default=0,
+                        help="log progress every this many steps")
+    parser.add_argument("--output", default=None,
+                        help="write the summary here instead of stdout")
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase and count hot calls")
+    parser.add_argument("--verbose", action="store_true",
+                        help="log while building the world")
+    return parser.parse_args(args)
+
+
+def report(message):
+    """Log progress to stderr, keeping stdout for the summary."""
+    sys.stderr.write(message + "\n")
+
+
+def run(simulation, steps, report_every=0, profile=False,
+        checkpoint_path=None, checkpoint_every=0, record_path=None,
+        record_every=1, record_resolutions=(1, 100, 10000)):
+    """Run simulation for steps steps.
+
+    Returns a summary of the run as a dict. If profile is True it includes
+    the time spent in each phase and counts of hot calls. If checkpoint_path
+    is given the simulation is saved there every checkpoint_every steps
+    and at the end. If record_path is given diagnostics are recorded there
+    every record_every steps (see recorder.py).
+    """
+    profiler = checkpointer = recorder = None
+    try:
+        if profile:
+            profiler = Profiler(simulation, count_calls=True)
+            profiler.start()
+        if checkpoint_path is not None and checkpoint_every > 0:
+            checkpointer = Checkpointer(simulation, checkpoint_path,
+                                        checkpoint_every)
+        if record_path is not None:
+            recorder = Recorder(simulation, record_path, record_every,
+                                record_resolutions)
+
+        start = time.time()
+        for step in range(1, steps + 1):
+            simulation.step()
+            if report_every and step % report_every == 0:
+                report("step {} of {}, {:.1f} steps/s".format(
+                    step, steps, step/(time.time() - start)))
+        finished = time.time()
+    finally:
+        # even if a step fails, so the recording is written and nothing is
+        # left waiting
+        if profiler is not None:
+            profiler.stop()
+        if recorder is not None:
+            recorder.close()
+        if checkpointer is not None:
+            checkpointer.close()
+
+    if checkpoint_path is not None:
+        checkpoint.save(simulation, checkpoint_path)
+
+    summary = {
+        "cells": len(simulation.world.state),
+        "steps": steps,
+        "time_step_size": simulation.config.time_step_size,
+        "simulated_time": simulation.time,
+        "run_seconds": finished - start,
+        "steps_per_second": steps/max(finished - start, 1e-9),
+    }
+    summary.update(simulation.world.state.diagnostics())
+    if profile:
+        summary["profile"] = profiler.report()
+    return summary
+
+
+def main(args=None):
+    """Run the simulation as the command line asks."""
+    args = parse_args(args)
+    settings.update(water_init_mode=args.water_init_mode,
+                    verbose=args.verbose)
+    if args.circumference is not None:
+        settings.update(world_cell_circumference=args.circumference)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    start = time.time()
+    if args.restore is None:
+        simulation = Simulation()
+    else:
+        simulation = checkpoint.restore(args.restore)
+    built = time.time() - start
+    if args.time_step is not None:
+        simulation.set_time_step(args.time_step)
+    if args.equilibrate:
+        start = time.time()
+        simulation.world.equilibrate()
+        equilibrated = time.time() - start
+
+    summary = run(simulation, args.steps, args.report_every, args.profile,
+                  args.checkpoint, args.checkpoint_every, args.record,
+                  args.record_every, args.record_resolutions)
+    summary["build_seconds"] = built
+    if args.equilibrate:
+        summary["equilibrate_seconds"] = equilibrated
+
+    text = json.dumps(summary, indent=2, sort_keys=True)
+    if args.output is None:
+        print text
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Backward Euler steps for phases too stiff to sub-step.
+
+A step so long that conduction or radiation would need more than
+settings.max_substeps sub-steps is instead taken in one go, solving for the
+temperatures at the end of the step that balance what each material gains
+and loses over it. That is stable for any step, and as the step grows the
+temperatures approach those equilibrium.py finds.
+"""
+
+import numpy as np
+from equilibrium import (absorbed_sunlight, column_conductance,
+                         conjugate_gradients)
+import settings
+
+
+def transfer_energy_horizontally(state):
+    """Conduct energy between neighboring cells for a whole time step.
+
+    Solves C(T - T0)/t = -L(T) for the land and then the water, where C is
+    each cell's heat capacity and L is conduction between neighbors, as in
+    equilibrium.laplacian. Energy is only moved, never made.
+    """
+    config = state.config
+    time = config.time_step_size
+    a, b = state.edges()
+
+    capacity = state.land_mass*config.land_specific_heat_capacity
+    conductance = np.repeat(float(config.land_conductance), len(a))
+    land_t = conjugate_gradients(capacity/time, a, b, conductance,
+                                 state.land_energy/time)
+    state.land_energy[:] = capacity*land_t
+
+    wet = state.water_mass > 0
+    wet_edges = wet[a] & wet[b]
+    a, b = a[wet_edges], b[wet_edges]
+    depth = state.water_depth
+    conductance = (depth[a] + depth[b])/2*config.water_conductance
+    capacity = state.water_mass*config.water_specific_heat_capacity
+    water_t = conjugate_gradients(np.where(wet, capacity/time, 1.0), a, b,
+                                  conductance,
+                                  np.where(wet, state.water_energy/time, 0.0))
+    state.water_energy[:] = np.where(wet, capacity*water_t,
+                                     state.water_energy)
+
+
+def transfer_energy_in_columns(state):
+    """Heat, radiate and conduct within each column for a whole time step.
+
+    This is what the column group's sub-steps do (see
+    Simulation.phase_groups). The land and water temperatures at the end
+    of the step are found by Newton's method, column by column, with the
+    terms of equilibrium.solve plus each material's heat capacity over the
+    step. Raises a ValueError if no iteration changes a temperature by less
+    than settings.equilibrium_tolerance (K) within
+    settings.equilibrium_iterations iterations.
+    """
+    config = state.config
+    time = config.time_step_size
+    wet = state.water_mass > 0
+    land_power, water_power = absorbed_sunlight(state)
+    land_power += config.core_power
+    infrared = -np.expm1(-config.infrared_attenuation * state.water_mass)
+    land_c = state.land_mass*config.land_specific_heat_capacity/time
+    water_c = np.where(
+        wet, state.water_mass*config.water_specific_heat_capacity/time, 1.0)
+
+    land_t0 = state.land_temperature
+    water_t0 = np.where(wet, state.water_temperature, 0.0)
+    land_t, water_t = land_t0, water_t0
+    for _ in range(settings.equilibrium_iterations):
+        conductance = column_conductance(config, land_t, water_t, wet)
+        land_radiation = config.land_emission*land_t**4
+        water_radiation = np.where(wet, config.water_emission*water_t**4,
+                                   0.0)
+        land_residual = (land_c*(land_t - land_t0) - land_power +
+                         land_radiation - water_radiation +
+                         conductance*(land_t - water_t))
+        water_residual = np.where(
+            wet,
+            water_c*(water_t - water_t0) - water_power -
+            infrared*land_radiation + 2*water_radiation +
+            conductance*(water_t - land_t),
+            0.0)
+
+        # the 2x2 Jacobian of each column, which is diagonal where dry
+        land_land = land_c + 4*config.land_emission*land_t**3 + conductance
+        land_water = np.where(
+            wet, -4*config.water_emission*water_t**3, 0.0) - conductance
+        water_land = (-4*infrared*config.land_emission*land_t**3 -
+                      conductance)
+        water_water = (water_c + conductance + np.where(
+            wet, 8*config.water_emission*water_t**3, 0.0))
+        water_land = np.where(wet, water_land, 0.0)
+        determinant = land_land*water_water - land_water*water_land
+        land_step = (land_water*water_residual -
+                     water_water*land_residual)/determinant
+        water_step = (water_land*land_residual -
+                      land_land*water_residual)/determinant
+
+        land_t = np.maximum(land_t + land_step, land_t/2)
+        water_t = np.where(wet, np.maximum(water_t + water_step, water_t/2),
+                           0.0)
+        change = max(np.abs(land_step).max() if len(land_t) else 0.0,
+                     np.abs(water_step).max() if len(water_t) else 0.0)
+        if change < settings.equilibrium_tolerance:
+            state.land_energy[:] = land_c*time*land_t
+            state.water_energy[:] = np.where(wet, water_c*time*water_t,
+                                             state.water_energy)
+            return
+    raise ValueError("no column temperatures found in {} iterations".format(
+        settings.equilibrium_iterations))
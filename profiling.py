@@ -0,0 +1,106 @@
+"""Tools for finding out where the simulation spends its time.
+
+A Profiler totals the time spent in each phase of Simulation.step and can
+also count calls to the hot per-cell and per-array functions:
+
+    profiler = Profiler(simulation, count_calls=True)
+    profiler.start()
+    ...
+    profiler.stop()
+    print profiler.report()
+
+Nothing is timed or counted unless a profiler is running.
+"""
+
+from collections import OrderedDict
+import cell
+import column_kernel
+import world_state
+
+# functions whose calls can be counted, as label: (owner, name)
+hot_calls = OrderedDict([
+    ("Cell.add_material", (cell.Cell, "add_material")),
+    ("Material.conduct_energy", (cell.Material, "conduct_energy")),
+    ("Material.radiate_energy", (cell.Material, "radiate_energy")),
+    ("ColumnKernel.conduct", (column_kernel.ColumnKernel, "conduct")),
+    ("ColumnKernel.radiate", (column_kernel.ColumnKernel, "radiate")),
+    ("world_state.conduct_across_edges",
+     (world_state, "conduct_across_edges"))
+])
+
+
+class Profiler():
+    """Totals the time spent in each phase of a simulation's steps."""
+
+    def __init__(self, simulation, count_calls=False):
+        """Create a profiler for simulation.
+
+        If count_calls is True calls to the functions in hot_calls are
+        counted too, which slows them down a little while running.
+        """
+        self.simulation = simulation
+        self.count_calls = count_calls
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        self.phase_seconds = OrderedDict()
+        self.phase_runs = OrderedDict()
+        self.calls = OrderedDict((label, 0) for label in hot_calls)
+
+    def start(self):
+        """Start recording."""
+        if self.running:
+            return
+        self.running = True
+        self.simulation.add_phase_callback(self.phase_finished)
+        if self.count_calls:
+            self.originals = {}
+            for label, (owner, name) in hot_calls.items():
+                function = owner.__dict__[name]
+                self.originals[label] = function
+                setattr(owner, name, self.counted(label, function))
+
+    def stop(self):
+        """Stop recording, putting back any counted functions."""
+        if not self.running:
+            return
+        self.running = False
+        self.simulation.remove_phase_callback(self.phase_finished)
+        if self.count_calls:
+            for label, (owner, name) in hot_calls.items():
+                setattr(owner, name, self.originals[label])
+
+    def counted(self, label, function):
+        """Wrap function so calls to it are counted under label."""
+        def wrapper(*args, **kwargs):
+            self.calls[label] += 1
+            return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        return wrapper
+
+    def phase_finished(self, name, seconds):
+        """Record that phase name took seconds."""
+        self.phase_seconds[name] = self.phase_seconds.get(name, 0.0) + seconds
+        self.phase_runs[name] = self.phase_runs.get(name, 0) + 1
+
+    def report(self):
+        """Recorded times and counts as a dict.
+
+        Each phase has its total and mean time and its share of the time
+        spent in all phases.
+        """
+        total = sum(self.phase_seconds.values())
+        phases = OrderedDict()
+        for name, seconds in self.phase_seconds.items():
+            phases[name] = {
+                "seconds": seconds,
+                "mean_seconds": seconds/self.phase_runs[name],
+                "share": seconds/total if total > 0 else 0.0
+            }
+        report = OrderedDict([("phases", phases)])
+        if self.count_calls:
+            report["calls"] = self.calls
+        return report
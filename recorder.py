@@ -0,0 +1,177 @@
+"""Recording global diagnostics as a simulation runs.
+
+A Recorder takes WorldState.diagnostics every so many steps and stores them
+as a time series at several resolutions: every record, and means, minima
+and maxima over blocks of records. Long runs can be kept at coarse
+resolutions only, so a million steps stay small on disk.
+
+A recording is a directory with a subdirectory for each resolution, such
+as "every-100". Each holds numbered chunks, which are array files (see
+array_file.py) with one array per column. Use read_recording to read one
+resolution back.
+"""
+
+from collections import OrderedDict
+import os
+import Queue
+import threading
+import numpy as np
+from array_file import read_arrays, write_arrays
+
+
+class Recorder():
+    """Records a simulation's diagnostics every so many steps.
+
+    Records are buffered and written a chunk at a time by a background
+    thread, so the step loop never waits for the disk.
+    """
+
+    def __init__(self, simulation, path, every=1, resolutions=(1, 100, 10000),
+                 chunk_rows=4096):
+        """Record simulation into the directory path every every steps.
+
+        resolutions are the numbers of records summarized by each row, at
+        each resolution kept. At resolution 1 each row is a record; at
+        resolution n each row holds the mean, min and max of n records.
+        Rows are written in chunks of chunk_rows.
+        """
+        self.simulation = simulation
+        self.path = path
+        self.every = every
+        self.chunk_rows = chunk_rows
+        self.steps = 0
+        self.columns = simulation.world.state.diagnostics().keys()
+        self.levels = [Level(n, self.columns) for n in resolutions]
+
+        self.chunks = Queue.Queue()
+        # a daemon, so the process can still exit if close is never called
+        self.thread = threading.Thread(target=self.write_chunks)
+        self.thread.daemon = True
+        self.thread.start()
+        simulation.add_step_callback(self.step_finished)
+
+    def step_finished(self, simulation):
+        """Count a step, recording the diagnostics if a record is due."""
+        self.steps += 1
+        if self.steps % self.every == 0:
+            values = np.array(simulation.world.state.diagnostics().values())
+            for level in self.levels:
+                level.add(self.steps, simulation.time, values)
+                if len(level.rows) >= self.chunk_rows:
+                    self.chunks.put(level.take_chunk())
+
+    def close(self):
+        """Stop recording and wait until everything is written.
+
+        Blocks at coarse resolutions that are not yet full are written as
+        they are, with the number of records they summarize in "count".
+        """
+        self.simulation.remove_step_callback(self.step_finished)
+        for level in self.levels:
+            level.finish()
+            if level.rows:
+                self.chunks.put(level.take_chunk())
+        self.chunks.put(None)
+        self.thread.join()
+
+    def write_chunks(self):
+        """Write chunks from the queue until told to stop, in a thread."""
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            level, number, arrays = chunk
+            directory = os.path.join(self.path, level_name(level))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            write_arrays(os.path.join(directory,
+                                      "chunk-{:06d}.eden".format(number)),
+                         arrays, {"kind": "recording", "resolution": level})
+
+
+class Level():
+    """The rows of a recording at one resolution."""
+
+    def __init__(self, resolution, columns):
+        """Summarize columns over blocks of resolution records."""
+        self.resolution = resolution
+        self.columns = columns
+        self.rows = []
+        self.chunks = 0
+        self.start_block()
+
+    def start_block(self):
+        """Start summarizing a new block of records."""
+        self.count = 0
+        self.total = np.zeros(len(self.columns))
+        self.lowest = np.repeat(np.inf, len(self.columns))
+        self.highest = np.repeat(-np.inf, len(self.columns))
+
+    def add(self, step, time, values):
+        """Add a record of values, taken after step steps at time time."""
+        if self.resolution == 1:
+            self.rows.append((step, time, values))
+            return
+        self.count += 1
+        self.total += values
+        np.minimum(self.lowest, values, out=self.lowest)
+        np.maximum(self.highest, values, out=self.highest)
+        self.step = step
+        self.time = time
+        if self.count == self.resolution:
+            self.finish()
+
+    def finish(self):
+        """End the current block, adding its row if it has any records."""
+        if self.count > 0:
+            self.rows.append((self.step, self.time, self.count,
+                              self.total/self.count, self.lowest,
+                              self.highest))
+            self.start_block()
+
+    def take_chunk(self):
+        """Remove the rows so far, as (resolution, number, arrays)."""
+        rows = zip(*self.rows)
+        arrays = {"step": np.array(rows[0], dtype=np.int64),
+                  "time": np.array(rows[1], dtype=float)}
+        if self.resolution == 1:
+            for name, column in zip(self.columns, np.array(rows[2]).T):
+                arrays[name] = column
+        else:
+            arrays["count"] = np.array(rows[2], dtype=np.int64)
+            for suffix, values in zip(["mean", "min", "max"], rows[3:]):
+                for name, column in zip(self.columns, np.array(values).T):
+                    arrays[name + "_" + suffix] = column
+        self.rows = []
+        self.chunks += 1
+        return self.resolution, self.chunks - 1, arrays
+
+
+def level_name(resolution):
+    """The name of the directory holding rows at resolution."""
+    return "every-{}".format(resolution)
+
+
+def read_recording(path, resolution=1):
+    """Read the rows of the recording at path at resolution.
+
+    Returns an OrderedDict of column arrays, with step and time first. A
+    row at step s and time t summarizes records up to and including s.
+    Raises a ValueError if there are no rows at resolution, as when nothing
+    was recorded.
+    """
+    directory = os.path.join(path, level_name(resolution))
+    chunks = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.startswith("chunk-") and name.endswith(".eden"):
+                chunks.append(read_arrays(os.path.join(directory, name),
+                                          mmap=False)[0])
+    if not chunks:
+        raise ValueError("{} has no rows at resolution {}".format(
+            path, resolution))
+    columns = OrderedDict()
+    for name in ["step", "time"] + sorted(set(chunks[0]) -
+                                          set(["step", "time"])):
+        columns[name] = np.concatenate([chunk[name] for chunk in chunks])
+    return columns
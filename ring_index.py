@@ -0,0 +1,91 @@
+"""An index of the rings of cells at each latitude."""
+
+import numpy as np
+from world_state import unit_vectors
+
+
+class RingIndex():
+    """The rings of cells that make up the world.
+
+    Cells are laid out in rings of equal latitude, starting from the ring
+    at 0 degrees, and the cells of each ring are evenly spaced in
+    longitude. Ring r holds the cells with indices offsets[r] to
+    offsets[r] + counts[r] - 1, spacing[r] degrees of longitude apart.
+    """
+
+    def __init__(self, offsets, counts, latitude_spacing, longitudes):
+        """Index rings of counts[r] cells starting at offsets[r].
+
+        Ring r is at latitude r*latitude_spacing. longitudes is the array of
+        every cell's longitude, which cell_at needs for the longitude of
+        each ring's first cell. It is the state's own array, not a copy.
+        """
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.spacing = 360.0/self.counts
+        self.latitude_spacing = latitude_spacing
+        self.longitudes = longitudes
+
+    @classmethod
+    def from_latitudes(cls, latitudes, longitudes):
+        """Index the rings of cells with the given coordinates.
+
+        The cells must be in ring order, as World.create_cells makes them.
+        """
+        rings, offsets, counts = np.unique(latitudes, return_index=True,
+                                           return_counts=True)
+        latitude_spacing = rings[1] - rings[0] if len(rings) > 1 else 180.0
+        return cls(offsets, counts, latitude_spacing, longitudes)
+
+    def __len__(self):
+        """The number of rings."""
+        return len(self.counts)
+
+    def ring(self, r):
+        """The indices of the cells in ring r, as a range."""
+        start = int(self.offsets[r])
+        return range(start, start + int(self.counts[r]))
+
+    def ring_of(self, latitude):
+        """The ring nearest latitude (a number or an array)."""
+        r = np.rint(np.asarray(latitude)/self.latitude_spacing)
+        return np.clip(r, 0, len(self) - 1).astype(np.int64)
+
+    def cell_at(self, latitude, longitude):
+        """The index of the cell nearest (latitude, longitude).
+
+        The nearest ring need not hold the nearest cell, as rings are
+        spaced differently in longitude, so the two cells either side of
+        longitude in that ring and the rings next to it are compared.
+        """
+        r = int(self.ring_of(latitude))
+        candidates = []
+        latitudes = []
+        for ring in range(max(0, r - 1), min(len(self), r + 2)):
+            start = int(self.offsets[ring])
+            n = int(self.counts[ring])
+            first = self.longitudes[start]
+            x = int(((longitude - first) % 360.0)//self.spacing[ring])
+            candidates += [start + x % n, start + (x + 1) % n]
+            latitudes += [ring*self.latitude_spacing]*2
+        candidates = np.array(candidates)
+        vectors = unit_vectors(latitudes, self.longitudes[candidates])
+        point = unit_vectors([latitude], [longitude])[0]
+        return int(candidates[np.dot(vectors, point).argmax()])
+
+    def positions(self):
+        """The ring of each cell and its place (from 0) within that ring."""
+        rings = np.repeat(np.arange(len(self)), self.counts)
+        return rings, np.arange(len(rings)) - self.offsets[rings]
+
+    def rotated(self, degrees):
+        """The cell shown at each place when the rings turn degrees east.
+
+        Element offsets[r] + p is the index of the cell at place p of ring
+        r, counting places from longitude 0 as if every cell had moved
+        degrees east. Working out each ring's shift is O(rings).
+        """
+        shifts = np.ceil(-degrees/self.spacing).astype(np.int64)
+        rings, places = self.positions()
+        return (self.offsets[rings] +
+                (places + shifts[rings]) % self.counts[rings])
@@ -7,10 +7,49 @@ import math
 #####  GAME SETTINGS  ######
 ######################## """
 
+# a simulation copies the settings its physics uses into a Config (see
+# config.py) when it is made, so changing them later only affects new
+# simulations
 time_step_size = 1  # (s)
 time_step_description = "1s"
 
 
+""" physics engine """
+# "arrays" runs each step on the arrays of the world's WorldState
+# "cells" runs the original per-cell methods of cell.py
+# "bands" runs the arrays' edge schemes in latitude bands, each in its own
+# process (see bands.py), whatever slosh_mode and conduction_mode say
+physics_mode = "arrays"
+# how many bands (and processes) the bands physics mode uses
+bands = 4
+# "sequential" moves water cell by cell in a random order
+# "edges" moves water across every edge at once, from one snapshot
+slosh_mode = "sequential"
+# "sequential" conducts energy between neighbors cell by cell
+# "edges" conducts energy across every edge at once, from one snapshot
+conduction_mode = "sequential"
+# check the arrays mode's column physics against the per-cell methods each
+# step, raising an error if a land or water energy differs by more than this
+# fraction of that material's energy (or its energy at 1 K). Rounding in a
+# deep ocean's radiation alone is about 1e-9 of its land's energy
+validate_columns = False
+column_tolerance = 1e-7
+
+""" sub-steps """
+# split phases into sub-steps when the time step is too long for them
+substepping = True
+# how far towards equilibrium with its neighbors (as a fraction) a cell may
+# conduct in one sub-step
+substep_limit = 0.5
+# the most sub-steps any group of phases is split into. A group that needs
+# more is run by World.long_step: sloshing until the water settles, and
+# conduction and the columns in one implicit step (see implicit.py)
+max_substeps = 100
+# water has settled once no cell's depth changes by more than this in a
+# sub-step (m)
+settled_depth = 1e-3
+
+
 """ ########################
 #####  WORLD SETTINGS  #####
 ######################## """
@@ -30,9 +69,18 @@ cell_degree_width = 360.0/float(world_cell_circumference)  # (degrees)
 cell_width = world_circumference/world_cell_circumference  # (m)
 cell_area = pow(cell_width, 2)
 
+""" geometry cache """
+# directory to cache the cells' layout and neighbors in, or None
+geometry_cache_dir = None
+
 """ world shape """
 min_ground_height = -10000
 max_ground_height = 10000
+n_distortions = 1000
+# cells whose terrain is worked out at once (memory use is proportional)
+terrain_chunk_size = 512
+# distance rows kept for raising terrain (each holds a float per cell)
+distance_cache_size = 64
 
 
 """ land properties """
@@ -43,6 +91,14 @@ land_thermal_conductivity = tv.earths_crust_thermal_conductivity
 """ world energy budgets """
 initial_land_temperature = 283  # (K)
 initial_water_temperature = 283
+# "fixed" starts the land and water at the initial temperatures above
+# "equilibrium" starts them at thermal equilibrium (see equilibrium.py)
+temperature_init_mode = "fixed"
+# the equilibrium solver stops once no temperature changes by more than
+# equilibrium_tolerance (K) in an iteration, or fails after
+# equilibrium_iterations iterations
+equilibrium_tolerance = 1e-6
+equilibrium_iterations = 100
 world_power = tv.earths_energy_production  # (W)
 
 """ densities """
@@ -90,6 +146,9 @@ map_width = 1200
 map_height = 600
 # width of border around map in px
 map_border = 0
+# "tiles" draws each cell as a canvas item, "image" draws the map as one
+# image (faster to create and paint for large worlds)
+map_renderer = "tiles"
 # size of each cell
 tile_height = map_height/float(world_cell_circumference/2 + 1)
 tile_width = map_width/float(world_cell_circumference)
@@ -98,6 +157,11 @@ draw_water = True
 # what mode are we drawing
 draw_mode = "terrain"
 draw_water = True
+# while running, "steps" updates the map every render_every steps and "fps"
+# updates it at most max_fps times a second
+render_mode = "fps"
+render_every = 10
+max_fps = 10
 
 """ ########################
 #####  MISC SETTINGS  ######
@@ -105,3 +169,25 @@ draw_water = True
 
 verbose = True
 debug = False
+
+
+def update(**values):
+    """Change some settings and recalculate the ones derived from them.
+
+    Derived settings (world_radius, cell_width, tile_width etc.) are always
+    recalculated, so set the settings they are derived from instead.
+    """
+    settings = globals()
+    for name, value in values.items():
+        if name not in settings:
+            raise AttributeError("There is no setting called {}".format(name))
+        settings[name] = value
+
+    global world_radius, cell_degree_width, cell_width, cell_area
+    global tile_height, tile_width
+    world_radius = world_circumference/(2*math.pi)
+    cell_degree_width = 360.0/float(world_cell_circumference)
+    cell_width = world_circumference/world_cell_circumference
+    cell_area = pow(cell_width, 2)
+    tile_height = map_height/float(world_cell_circumference/2 + 1)
+    tile_width = map_width/float(world_cell_circumference)
@@ -1,36 +1,131 @@
 """The simulation class."""
 
 from world import World
-from sun import Sun
 from utility import log
+import functools
+import settings
+import time
 
 
 class Simulation():
     """The simulation class executes the simulation.
 
-    Upon initialization it creates the system - the world, sun, oceans etc.
-    The step function proceeds forwards in time.
+    Upon initialization it creates the system - the world, oceans etc.
+    The step function proceeds forwards in time. The settings the physics
+    uses are copied into the world's Config when the world is made, so
+    changing settings afterwards does not affect the simulation; use
+    set_time_step to change the time step.
     """
 
-    def __init__(self):
-        """Create the simulation."""
-        log("> Creating world")
-        self.create_world()
-        log("> Creating sun")
-        self.create_sun()
+    def __init__(self, world=None):
+        """Create the simulation, around world if one is given."""
+        self.time = 0
+        # functions called as f(phase name, seconds) after each phase
+        self.phase_callbacks = []
+        # functions called as f(simulation) after each step
+        self.step_callbacks = []
+        if world is None:
+            log("> Creating world")
+            self.create_world()
+        else:
+            self.world = world
 
     def create_world(self):
         """Create the world."""
         self.world = World()
 
-    def create_sun(self):
-        """Create the sun."""
-        self.sun = Sun()
+    @property
+    def config(self):
+        """The Config the simulation runs with."""
+        return self.world.config
+
+    def set_time_step(self, time_step_size):
+        """Change the length (s) of each step."""
+        self.world.config = self.config.with_time_step(time_step_size)
+
+    def phases(self):
+        """The phases of a step, in order, as (name, function) pairs."""
+        return [phase for _, group in self.phase_groups() for phase in group]
+
+    def phase_groups(self):
+        """The phases of a step, as (group name, phases) pairs.
+
+        The phases of a group, (name, function) pairs, are sub-stepped
+        together.
+        """
+        world = self.world
+        return [
+            ("slosh_oceans", [("slosh_oceans", world.slosh_oceans)]),
+            ("transfer_energy_horizontally",
+             [("transfer_energy_horizontally",
+               world.transfer_energy_horizontally)]),
+            ("column", [
+                ("absorb_energy_from_core", world.absorb_energy_from_core),
+                ("absorb_energy_from_sun", world.absorb_energy_from_sun),
+                ("transfer_energy_vertically",
+                 world.transfer_energy_vertically)])
+        ]
 
     def step(self):
         """Advance 1 time step."""
-        self.world.slosh_oceans()
-        self.world.transfer_energy_vertically()
-        self.world.transfer_energy_horizontally()
-        self.world.absorb_energy_from_core()
-        self.world.absorb_energy_from_sun(self.sun)
+        self.time += self.config.time_step_size
+        for name, group in self.phase_groups():
+            self.run_phases(name, group)
+        for callback in self.step_callbacks:
+            callback(self)
+
+    def run_phases(self, name, group):
+        """Run the group of phases called name for a time step.
+
+        The group is split into as many sub-steps as World.substeps says it
+        needs, unless that is more than settings.max_substeps, when it is
+        run by World.long_step instead. Phase callbacks get each phase's
+        time summed over the sub-steps, or the group's for a long step.
+        """
+        substeps = 1
+        if settings.substepping:
+            substeps = self.world.substeps(name)
+        if substeps > settings.max_substeps:
+            group = [(name, functools.partial(self.world.long_step, name,
+                                              substeps))]
+            substeps = 1
+        config = self.config
+        if substeps > 1:
+            self.world.config = config.with_time_step(
+                config.time_step_size/float(substeps))
+        try:
+            if self.phase_callbacks:
+                seconds = dict((phase_name, 0.0) for phase_name, _ in group)
+                for _ in range(substeps):
+                    for phase_name, phase in group:
+                        start = time.time()
+                        phase()
+                        seconds[phase_name] += time.time() - start
+                for phase_name, _ in group:
+                    for callback in self.phase_callbacks:
+                        callback(phase_name, seconds[phase_name])
+            else:
+                for _ in range(substeps):
+                    for _, phase in group:
+                        phase()
+        finally:
+            self.world.config = config
+
+    def add_phase_callback(self, callback):
+        """Call callback(phase name, seconds) after each phase of a step.
+
+        Phases are only timed while there are callbacks.
+        """
+        self.phase_callbacks.append(callback)
+
+    def remove_phase_callback(self, callback):
+        """Stop calling callback after each phase."""
+        self.phase_callbacks.remove(callback)
+
+    def add_step_callback(self, callback):
+        """Call callback(simulation) after each step."""
+        self.step_callbacks.append(callback)
+
+    def remove_step_callback(self, callback):
+        """Stop calling callback after each step."""
+        self.step_callbacks.remove(callback)
@@ -0,0 +1,312 @@
+"""Tests of the world's construction and physics."""
+
+import math
+import os
+import random
+import shutil
+import tempfile
+import types
+import unittest
+import numpy as np
+import checkpoint
+import geometry_cache
+from recorder import Recorder, read_recording
+import settings
+from simulation import Simulation
+from world import World, great_circle_distance
+from world_state import WorldState, unit_vectors
+
+
+class SettingsTest(unittest.TestCase):
+    """A test that may change settings, which are put back after it."""
+
+    def setUp(self):
+        self.saved = dict(
+            (name, value) for name, value in vars(settings).items()
+            if not name.startswith("_") and not callable(value) and
+            not isinstance(value, types.ModuleType))
+        settings.update(verbose=False)
+
+    def tearDown(self):
+        settings.update(**self.saved)
+
+
+class FindNeighborsTest(SettingsTest):
+    """find_neighbors against testing every pair of cells."""
+
+    def test_matches_all_pairs(self):
+        for circumference in range(3, 41):
+            settings.update(world_cell_circumference=circumference)
+            world = World(build=False)
+            world.create_cells()
+            state = world.state
+            self.assertEqual(state.neighbors,
+                             all_pairs_neighbors(state.latitude.tolist(),
+                                                 state.longitude.tolist()),
+                             "circumference {}".format(circumference))
+
+
+class CellAtTest(SettingsTest):
+    """RingIndex.cell_at against testing every cell."""
+
+    def test_finds_nearest_cell(self):
+        points = random.Random(0)
+        for circumference in range(3, 41):
+            settings.update(world_cell_circumference=circumference)
+            world = World(build=False)
+            world.create_cells()
+            state = world.state
+            vectors = unit_vectors(state.latitude, state.longitude)
+            for _ in range(100):
+                latitude = points.uniform(0, 180)
+                longitude = points.uniform(0, 360)
+                closeness = np.dot(
+                    vectors, unit_vectors([latitude], [longitude])[0])
+                cell = world.ring_index.cell_at(latitude, longitude)
+                self.assertAlmostEqual(
+                    closeness[cell], closeness.max(), places=12,
+                    msg="circumference {} at ({}, {})".format(
+                        circumference, latitude, longitude))
+
+
+class LongStepTest(SettingsTest):
+    """Steps far too long to sub-step."""
+
+    def test_temperatures_stay_bounded(self):
+        settings.update(world_cell_circumference=24, water_init_mode="dump")
+        random.seed(0)
+        simulation = Simulation()
+        # 1000 years
+        simulation.set_time_step(1000*365*24*3600)
+        state = simulation.world.state
+        for _ in range(10):
+            simulation.step()
+            wet = state.water_mass > 0
+            self.assertTrue(np.isfinite(state.land_energy).all())
+            self.assertTrue(np.isfinite(state.water_energy).all())
+            self.assertLess(state.land_temperature.max(), 500)
+            self.assertLess(state.water_temperature[wet].max(), 500)
+            self.assertGreater(state.land_temperature.min(), 0)
+
+
+class SloshByEdgeTest(SettingsTest):
+    """WorldState.slosh_oceans_by_edge."""
+
+    def setUp(self):
+        SettingsTest.setUp(self)
+        settings.update(world_cell_circumference=24, water_init_mode="dump",
+                        time_step_size=3600)
+
+    def sloshed(self, seed):
+        """A new world's state after sloshing, with random seeded by seed."""
+        random.seed(0)
+        state = World().state
+        random.seed(seed)
+        for _ in range(50):
+            state.slosh_oceans_by_edge()
+        return state
+
+    def test_conserves_water(self):
+        random.seed(0)
+        state = World().state
+        mass = state.water_mass.sum()
+        energy = state.water_energy.sum()
+        for _ in range(50):
+            state.slosh_oceans_by_edge()
+        self.assertGreater((state.water_mass > 0).sum(), 1)
+        self.assertTrue((state.water_mass >= 0).all())
+        self.assertAlmostEqual(state.water_mass.sum()/mass, 1, places=12)
+        self.assertAlmostEqual(state.water_energy.sum()/energy, 1,
+                               places=12)
+
+    def test_is_deterministic(self):
+        first = self.sloshed(1)
+        second = self.sloshed(2)
+        for field in ["water_mass", "water_energy"]:
+            self.assertTrue(np.array_equal(getattr(first, field),
+                                           getattr(second, field)), field)
+
+
+class ConductByEdgeTest(SettingsTest):
+    """WorldState.transfer_energy_horizontally_by_edge."""
+
+    def setUp(self):
+        SettingsTest.setUp(self)
+        settings.update(world_cell_circumference=24, water_init_mode="dump",
+                        time_step_size=6000)
+
+    def uneven_state(self):
+        """A new world with water spread out and uneven temperatures."""
+        random.seed(0)
+        state = World().state
+        for _ in range(200):
+            state.slosh_oceans_by_edge()
+        uneven = np.random.RandomState(0)
+        state.land_energy *= uneven.uniform(0.5, 1.5, len(state))
+        state.water_energy *= uneven.uniform(0.5, 1.5, len(state))
+        return state
+
+    def test_conserves_energy(self):
+        state = self.uneven_state()
+        land, water = state.land_energy.sum(), state.water_energy.sum()
+        for _ in range(100):
+            state.transfer_energy_horizontally_by_edge()
+        self.assertAlmostEqual(state.land_energy.sum()/land, 1, places=12)
+        self.assertAlmostEqual(state.water_energy.sum()/water, 1,
+                               places=12)
+
+    def test_matches_sequential(self):
+        start = self.uneven_state()
+        sequential = self.uneven_state()
+        edges = self.uneven_state()
+        for _ in range(100):
+            sequential.transfer_energy_horizontally()
+            edges.transfer_energy_horizontally_by_edge()
+        # the paths differ only in the order exchanges are applied, which
+        # matters about as much as the conduction in one step
+        for field in ["land_energy", "water_energy"]:
+            moved = np.abs(getattr(sequential, field) -
+                           getattr(start, field)).max()
+            difference = np.abs(getattr(sequential, field) -
+                                getattr(edges, field)).max()
+            self.assertGreater(moved, 0, field)
+            self.assertLess(difference, 0.01*moved, field)
+
+
+class BandsTest(SettingsTest):
+    """The bands physics mode against one process."""
+
+    def test_matches_edges_mode(self):
+        settings.update(world_cell_circumference=24, water_init_mode="dump",
+                        slosh_mode="edges", conduction_mode="edges",
+                        time_step_size=3600)
+        expected = stepped_state(physics_mode="arrays")
+        for bands in [1, 3, 5]:
+            state = stepped_state(physics_mode="bands", bands=bands)
+            for field in WorldState.fields:
+                self.assertTrue(
+                    np.array_equal(getattr(state, field),
+                                   getattr(expected, field)),
+                    "{} in {} bands".format(field, bands))
+
+
+class CheckpointTest(SettingsTest):
+    """Saving and restoring simulations."""
+
+    def test_restored_simulation_steps_the_same(self):
+        settings.update(world_cell_circumference=24, water_init_mode="dump",
+                        time_step_size=3600*24*30)
+        random.seed(0)
+        simulation = Simulation()
+        descriptor, path = tempfile.mkstemp(suffix=".eden")
+        os.close(descriptor)
+        try:
+            for _ in range(3):
+                simulation.step()
+            checkpoint.save(simulation, path)
+            for _ in range(3):
+                simulation.step()
+
+            # the restored simulation keeps the settings it was saved with
+            settings.update(sun_power=2*settings.sun_power,
+                            time_step_size=3600)
+            restored = checkpoint.restore(path)
+            try:
+                for _ in range(3):
+                    restored.step()
+                self.assertEqual(restored.time, simulation.time)
+                for field in WorldState.fields:
+                    self.assertTrue(np.array_equal(
+                        getattr(restored.world.state, field),
+                        getattr(simulation.world.state, field)), field)
+            finally:
+                restored.world.close()
+        finally:
+            simulation.world.close()
+            os.remove(path)
+
+
+class GeometryCacheTest(SettingsTest):
+    """The on-disk cache of world geometry."""
+
+    def test_cut_short_cache_is_rebuilt(self):
+        directory = tempfile.mkdtemp()
+        try:
+            settings.update(world_cell_circumference=24,
+                            geometry_cache_dir=directory)
+            random.seed(0)
+            latitude = World().state.latitude
+            path = geometry_cache.path()
+            self.assertEqual(os.listdir(directory),
+                             [os.path.basename(path)])
+            with open(path, "rb") as f:
+                contents = f.read()
+            for length in [0, 4, 12, 40, len(contents)//2]:
+                with open(path, "wb") as f:
+                    f.write(contents[:length])
+                self.assertIsNone(geometry_cache.load())
+                random.seed(0)
+                self.assertTrue(np.array_equal(World().state.latitude,
+                                               latitude))
+        finally:
+            shutil.rmtree(directory)
+
+
+class RecorderTest(SettingsTest):
+    """Recording diagnostics and reading them back."""
+
+    def setUp(self):
+        SettingsTest.setUp(self)
+        settings.update(world_cell_circumference=24)
+        self.directory = tempfile.mkdtemp()
+        random.seed(0)
+        self.simulation = Simulation()
+
+    def tearDown(self):
+        self.simulation.world.close()
+        shutil.rmtree(self.directory)
+        SettingsTest.tearDown(self)
+
+    def test_reads_back_what_was_recorded(self):
+        recorder = Recorder(self.simulation, self.directory,
+                            resolutions=(1, 2), chunk_rows=2)
+        for _ in range(5):
+            self.simulation.step()
+        recorder.close()
+        rows = read_recording(self.directory)
+        self.assertEqual(rows.keys()[:2], ["step", "time"])
+        self.assertTrue(all(type(name) is str for name in rows))
+        self.assertEqual(rows["step"].tolist(), [1, 2, 3, 4, 5])
+        blocks = read_recording(self.directory, 2)
+        self.assertEqual(blocks["count"].tolist(), [2, 2, 1])
+
+    def test_nothing_recorded(self):
+        Recorder(self.simulation, self.directory).close()
+        self.assertRaises(ValueError, read_recording, self.directory)
+
+
+def stepped_state(steps=5, seed=0, **values):
+    """The state of a world built and stepped with the given settings."""
+    settings.update(**values)
+    random.seed(seed)
+    simulation = Simulation()
+    try:
+        for _ in range(steps):
+            simulation.step()
+    finally:
+        simulation.world.close()
+    return simulation.world.state
+
+
+def all_pairs_neighbors(latitudes, longitudes):
+    """The neighbors of each cell, found by testing every pair of cells."""
+    max_distance = 1.3*math.radians(settings.cell_degree_width)
+    return [[b for b in range(len(latitudes))
+             if b != a and great_circle_distance(
+                 latitudes[a], longitudes[a],
+                 latitudes[b], longitudes[b]) < max_distance]
+            for a in range(len(latitudes))]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,27 @@
 """The user interface."""
 
-from Tkinter import Button, Canvas, Label, StringVar, W, E
+from Tkinter import Button, Canvas, Label, PhotoImage, StringVar, NW, W, E
+import base64
+import numpy as np
 import settings
 from utility import log
 
+# the color scale of each draw mode, as segments of (col_min, col_max)
+palettes = {
+    "terrain": [([50, 20, 4], [255, 255, 255]),  # land
+                ([153, 204, 255], [20, 20, 80])],  # water
+    "heat": [([0, 0, 0], [82, 219, 255]),  # below 223K
+             ([82, 219, 255], [255, 255, 255]),  # 223-273K
+             ([255, 255, 255], [255, 66, 0]),  # 273-313K
+             ([255, 66, 0], [0, 0, 0])],  # 313K and above
+    "wind": [([0, 0, 0], [255, 255, 255])]
+}
+# temperatures (K) where each heat segment starts and its width
+heat_starts = np.array([0.0, 223.0, 273.0, 313.0])
+heat_widths = np.array([223.0, 50.0, 40.0, 100.0])
+# shades each segment is quantized to
+shades = 256
+
 
 class UI():
     """The UI class manages the buttons, map and tiles.
@@ -17,6 +35,15 @@ class UI():
         self.app = app
         self.frame = frame
         self.world = self.app.simulation.world
+        # the worker's snapshot the map was last painted from
+        self.snapshot = self.app.worker.snapshot
+
+        # every color a tile can be, and where each draw mode's colors start
+        self.colors, self.palette_offsets = color_table()
+
+        # brush strokes waiting to be applied, as (cell, height)
+        self.strokes = []
+        self.last_stroke_cell = None
 
         self.add_buttons()
         self.add_other_widgets()
@@ -61,47 +88,157 @@ class UI():
             self.frame.grid_columnconfigure(c, minsize=settings.map_width/12)
 
     def create_tiles(self):
-        """Create blank tiles."""
+        """Create blank tiles.
+
+        settings.map_renderer chooses how: "tiles" makes a canvas rectangle
+        for each cell and "image" shows every cell in a single image. Tiles
+        are laid out like the cells, ring by ring as in world.ring_index,
+        so until the map is turned tile x shows the cell with state index x.
+        """
         self.map.delete("all")
-        self.tiles = []
-        for cell in self.world.cells:
-            n_in_row = len([c for c in self.world.cells
-                            if c.latitude == cell.latitude])
-            x_start = ((settings.map_width/2.0) -
-                       (n_in_row/2.0)*settings.tile_width)
-            y_start = ((cell.latitude/settings.cell_degree_width) *
-                       settings.tile_height)
-
-            self.tiles.append(self.map.create_rectangle(
-                (x_start +
-                    (cell.longitude/360.0) * n_in_row * settings.tile_width),
-                y_start,
-                (x_start + settings.tile_width + 1 +
-                    (cell.longitude/360.0) * n_in_row * settings.tile_width),
-                y_start + settings.tile_height,
-                fill="yellow",
-                outline=""))
-        for x in range(len(self.tiles)):
-            self.map.tag_bind(self.tiles[x], "<ButtonPress-1>",
-                              lambda event, arg=x: self.left_click_tile(arg))
-            self.map.tag_bind(self.tiles[x], "<ButtonPress-2>",
-                              lambda event, arg=x: self.right_click_tile(arg))
-
-    def left_click_tile(self, x):
-        """Tell world to raise terrain at cell x."""
-        self.world.raise_cell(x, 1000)
+        self.renderer = settings.map_renderer
+        rectangles = self.tile_rectangles()
+        # how far (degrees east) the map is turned and the state index of
+        # the cell each tile shows
+        self.rotation = 0.0
+        self.tile_cells = self.world.ring_index.rotated(self.rotation)
+        # the index in self.colors of each tile's color, -1 if not painted
+        self.tile_colors = np.repeat(-1, len(rectangles))
+
+        if self.renderer == "tiles":
+            self.tiles = [self.map.create_rectangle(*r, fill="yellow",
+                                                    outline="")
+                          for r in rectangles]
+        elif self.renderer == "image":
+            self.create_image()
+        self.map.bind("<ButtonPress-1>",
+                      lambda event: self.click_map(event, 1000))
+        self.map.bind("<ButtonPress-2>",
+                      lambda event: self.click_map(event, -1000))
+        self.map.bind("<B1-Motion>",
+                      lambda event: self.drag_over_tile(event, 1000))
+        self.map.bind("<B2-Motion>",
+                      lambda event: self.drag_over_tile(event, -1000))
+
+    def tile_rectangles(self):
+        """The (x0, y0, x1, y1) corners of each tile on the map."""
+        ring_index = self.world.ring_index
+        rings, places = ring_index.positions()
+        n = ring_index.counts[rings]
+        x_start = ((settings.map_width/2.0) - (n/2.0)*settings.tile_width +
+                   places*settings.tile_width)
+        y_start = rings*settings.tile_height
+        return zip(x_start.tolist(), y_start.tolist(),
+                   (x_start + settings.tile_width + 1).tolist(),
+                   (y_start + settings.tile_height).tolist())
+
+    def tiles_at(self, xs, ys):
+        """The tile at each pixel (x, y) of the map, for arrays xs and ys.
+
+        Returns an array with a row for each y and a column for each x,
+        holding -1 where there is no tile.
+        """
+        ring_index = self.world.ring_index
+        rings = np.floor(np.asarray(ys, dtype=float) /
+                         settings.tile_height).astype(np.int64)
+        on_map = (rings >= 0) & (rings < len(ring_index))
+        rings = np.clip(rings, 0, len(ring_index) - 1)[:, np.newaxis]
+        n = ring_index.counts[rings]
+        x_start = (settings.map_width/2.0) - (n/2.0)*settings.tile_width
+        places = np.floor((np.asarray(xs, dtype=float) - x_start) /
+                          settings.tile_width).astype(np.int64)
+        return np.where(on_map[:, np.newaxis] & (places >= 0) & (places < n),
+                        ring_index.offsets[rings] + places, -1)
+
+    def tile_at(self, x, y):
+        """The tile at pixel (x, y) of the map, or None if there is none."""
+        tile = self.tiles_at([x], [y])[0, 0]
+        return tile if tile >= 0 else None
+
+    def create_image(self):
+        """Create the map as one image, for the "image" renderer.
+
+        Works out which tile each pixel shows (-1 for none), so the image
+        can be filled in with array lookups.
+        """
+        width = settings.map_width + 2*settings.map_border
+        height = settings.map_height + 2*settings.map_border
+        self.pixel_tiles = self.tiles_at(np.arange(width), np.arange(height))
+
+        # the colors as RGB, with black for pixels showing no tile last
+        self.color_rgb = np.array(
+            [[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in self.colors] +
+            [[0, 0, 0]], dtype=np.uint8)
+        self.image = PhotoImage(width=width, height=height)
+        self.map.create_image(0, 0, image=self.image, anchor=NW)
+
+    def rotate(self, degrees):
+        """Turn the map degrees east, without moving any cells."""
+        self.rotation = (self.rotation + degrees) % 360.0
+        self.tile_cells = self.world.ring_index.rotated(self.rotation)
         self.paint_tiles()
 
-    def right_click_tile(self, x):
-        """Tell world to raise terrain at cell x."""
-        self.world.raise_cell(x, -1000)
+    def click_map(self, event, height):
+        """Raise terrain at the tile clicked on."""
+        x = self.tile_at(event.x, event.y)
+        if x is not None:
+            self.add_stroke(self.tile_cells[x], height)
+
+    def drag_over_tile(self, event, height):
+        """Raise terrain at the tile under the mouse, once per tile."""
+        x = self.tile_at(event.x, event.y)
+        if x is not None and self.tile_cells[x] != self.last_stroke_cell:
+            self.add_stroke(self.tile_cells[x], height)
+
+    def add_stroke(self, cell, height):
+        """Queue a brush stroke at the cell with state index cell.
+
+        Strokes are applied together once Tk is idle, so fast clicks and
+        drags become a single edit of the world.
+        """
+        if not self.strokes:
+            self.master.after_idle(self.apply_strokes)
+        self.strokes.append((cell, height))
+        self.last_stroke_cell = cell
+
+    def apply_strokes(self):
+        """Send all queued brush strokes to the worker to apply."""
+        cells = [c for c, _ in self.strokes]
+        heights = [h for _, h in self.strokes]
+        self.strokes = []
+        self.app.worker.submit(self.world.raise_cells, cells, heights)
+
+    def paint_snapshot(self, snapshot):
+        """Paint the map and time from a new snapshot."""
+        self.snapshot = snapshot
+        self.update_time_label(snapshot.time)
         self.paint_tiles()
 
     def paint_tiles(self):
-        """Color the tiles."""
-        for x in range(len(self.tiles)):
-            self.map.itemconfigure(self.tiles[x],
-                                   fill=self.cell_color(self.world.cells[x]))
+        """Color the tiles from the current snapshot.
+
+        Only tiles whose color has changed since they were last painted are
+        passed to Tk.
+        """
+        colors = self.color_indices()[self.tile_cells]
+        changed = np.flatnonzero(colors != self.tile_colors)
+        if self.renderer == "tiles":
+            for x in changed:
+                self.map.itemconfigure(self.tiles[x],
+                                       fill=self.colors[colors[x]])
+        elif self.renderer == "image" and len(changed) > 0:
+            self.paint_image(colors)
+        self.tile_colors = colors
+
+    def paint_image(self, colors):
+        """Fill in the map image, given each tile's index in self.colors."""
+        # pixels showing no tile have index -1, which picks the appended
+        # black
+        pixel_colors = np.append(colors, len(self.colors))[self.pixel_tiles]
+        pixels = self.color_rgb[pixel_colors]
+        height, width = self.pixel_tiles.shape
+        ppm = "P6 {} {} 255\n".format(width, height) + pixels.tostring()
+        self.image.configure(data=base64.b64encode(ppm), format="PPM")
 
     def update_time_label(self, time):
         """Update the UI time label."""
@@ -122,54 +259,35 @@ class UI():
                             .format(hour, minute, second, day, year))
         self.time_rate.set("x{}".format(settings.time_step_description))
 
-    def cell_color(self, cell):
-        """Work out what color a tile should be.
+    def color_indices(self):
+        """Work out the index in self.colors of each cell's color.
 
-        The color depends on the cell and the draw_mode parameter.
+        The color depends on the snapshot and the draw_mode parameter.
         """
+        snapshot = self.snapshot
         if settings.draw_mode == "terrain":
-            if cell.water.depth == 0.0 or settings.draw_water is False:
-                col_min = [50, 20, 4]
-                col_max = [255, 255, 255]
-                p = ((cell.land.height - settings.min_ground_height) /
-                     (settings.max_ground_height - settings.min_ground_height))
-            else:
-                col_min = [153, 204, 255]
-                col_max = [20, 20, 80]
-                p = cell.water.depth/6000.0
-                if p > 1:
-                    p = 1
+            land = snapshot.water_depth == 0.0
+            if settings.draw_water is False:
+                land[:] = True
+            segment = np.where(land, 0, 1)
+            p = np.where(
+                land,
+                ((snapshot.land_height - settings.min_ground_height) /
+                 (settings.max_ground_height - settings.min_ground_height)),
+                snapshot.water_depth/6000.0)
         elif settings.draw_mode == "heat":
             if settings.draw_water is True:
-                temp = cell.surface_temperature
+                temp = snapshot.surface_temperature
             else:
-                temp = cell.land.temperature
-            if temp < 223:
-                col_min = [0, 0, 0]
-                col_max = [82, 219, 255]
-                p = max(min((temp)/223.0, 1), 0)
-            elif temp < 273:
-                col_min = [82, 219, 255]
-                col_max = [255, 255, 255]
-                p = max(min((temp-223.0)/50.0, 1), 0)
-            elif temp < 313:
-                col_min = [255, 255, 255]
-                col_max = [255, 66, 0]
-                p = max(min((temp-273.0)/40.0, 1), 0)
-            else:
-                col_min = [255, 66, 0]
-                col_max = [0, 0, 0]
-                p = max(min((temp-313.0)/100.0, 1), 0)
-
+                temp = snapshot.land_temperature
+            segment = np.searchsorted(heat_starts[1:], temp, side="right")
+            p = (temp - heat_starts[segment])/heat_widths[segment]
         elif settings.draw_mode == "wind":
-            col_min = [0, 0, 0]
-            col_max = [255, 255, 255]
-            p = min(cell.wind_speed, 10)/10
-        q = 1-p
-        col = [int(q*col_min[0] + p*col_max[0]),
-               int(q*col_min[1] + p*col_max[1]),
-               int(q*col_min[2] + p*col_max[2])]
-        return '#%02X%02X%02X' % (col[0], col[1], col[2])
+            segment = 0
+            p = snapshot.wind_speed/10.0
+        shade = np.rint(np.clip(p, 0, 1)*(shades - 1)).astype(int)
+        return (self.palette_offsets[settings.draw_mode] +
+                segment*shades + shade)
 
     def draw_terrain(self):
         """Paint map by altitude."""
@@ -185,3 +303,25 @@ class UI():
         """Toggle whether water is shown in terrain mode."""
         settings.draw_water = not settings.draw_water
         self.paint_tiles()
+
+
+def color_table():
+    """Make the color of every shade of every palette.
+
+    Returns the colors, as Tk color strings, and a dict of where each draw
+    mode's palette starts among them. Segment s of a palette starting at i
+    runs from i + s*shades to i + (s + 1)*shades - 1.
+    """
+    colors = []
+    offsets = {}
+    for mode, segments in sorted(palettes.items()):
+        offsets[mode] = len(colors)
+        for col_min, col_max in segments:
+            for shade in range(shades):
+                p = shade/float(shades - 1)
+                q = 1-p
+                col = [int(q*col_min[0] + p*col_max[0]),
+                       int(q*col_min[1] + p*col_max[1]),
+                       int(q*col_min[2] + p*col_max[2])]
+                colors.append('#%02X%02X%02X' % (col[0], col[1], col[2]))
+    return colors, offsets
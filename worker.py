@@ -0,0 +1,115 @@
+"""Running the simulation in a background thread.
+
+A Worker steps a simulation in its own thread, so Tk's event loop never
+runs physics. Anything that changes the simulation is sent to the worker
+as a command and run between steps. The worker publishes Snapshots of what
+the map shows, and the UI paints from those rather than the world.
+"""
+
+import Queue
+import threading
+import time
+import settings
+
+
+class Snapshot():
+    """A read-only copy of what the map shows, at one moment.
+
+    Element i of each array belongs to the cell with state index i.
+    """
+
+    def __init__(self, simulation):
+        """Copy the fields the map shows from simulation."""
+        state = simulation.world.state
+        self.time = simulation.time
+        self.land_height = state.land_height.copy()
+        self.water_depth = state.water_depth
+        self.land_temperature = state.land_temperature
+        self.surface_temperature = state.surface_temperature
+        for array in [self.land_height, self.water_depth,
+                      self.land_temperature, self.surface_temperature]:
+            array.flags.writeable = False
+
+
+class Worker():
+    """Steps a simulation in a background thread.
+
+    Snapshots are double buffered: the UI paints from the last one
+    published (snapshot) while the worker builds the next off to the side
+    and swaps it in with a single assignment. So the UI always sees a whole
+    frame and never waits for a step. Snapshots are published as often as
+    settings.render_mode asks, and after every batch of commands.
+    """
+
+    def __init__(self, simulation):
+        """Start a stopped worker for simulation."""
+        self.simulation = simulation
+        self.commands = Queue.Queue()
+        self.running = False
+        self.steps_since_publish = 0
+        self.last_publish_time = time.time()
+        self.publish()
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function, *args):
+        """Run function(*args) on the worker thread, between steps."""
+        self.commands.put((function, args))
+
+    def toggle_running(self):
+        """Start stepping if stopped, or stop if running."""
+        self.submit(self.set_running, None)
+
+    def close(self):
+        """Stop the worker and wait for its thread to finish."""
+        self.commands.put((None, ()))
+        self.thread.join()
+
+    """ #####################
+    ##### WORKER THREAD #####
+    ######################"""
+
+    def run(self):
+        """Step the simulation and run commands until the worker is closed."""
+        while True:
+            # when stopped there is nothing to do until a command comes
+            commands = [] if self.running else [self.commands.get()]
+            while True:
+                try:
+                    commands.append(self.commands.get_nowait())
+                except Queue.Empty:
+                    break
+            for function, args in commands:
+                if function is None:
+                    return
+                function(*args)
+            if commands:
+                self.publish()
+
+            if self.running:
+                self.simulation.step()
+                self.steps_since_publish += 1
+                if self.frame_due():
+                    self.publish()
+
+    def set_running(self, running):
+        """Start or stop stepping, or toggle if running is None."""
+        if running is None:
+            running = not self.running
+        self.running = running
+
+    def frame_due(self):
+        """Whether a snapshot should be published after this step."""
+        if settings.render_mode == "steps":
+            return self.steps_since_publish >= settings.render_every
+        elif settings.render_mode == "fps":
+            return (time.time() - self.last_publish_time >=
+                    1.0/settings.max_fps)
+
+    def publish(self):
+        """Take a snapshot of the simulation and swap it in for the UI."""
+        self.snapshot = Snapshot(self.simulation)
+        self.steps_since_publish = 0
+        self.last_publish_time = time.time()
@@ -1,13 +1,35 @@
 """The world class."""
 
 import random
+from collections import OrderedDict
+from bands import Bands
 from cell import Cell
+import equilibrium
+import implicit
+from ring_index import RingIndex
+from world_state import WorldState, angles_between, unit_vectors
+import geometry_cache
 import settings
 import math
-from utility import log
+import numpy as np
+from utility import debug, log
 
 
-class World():
+def great_circle_distance(lat1, long1, lat2, long2):
+    """The angle (radians) between two points on the world's surface."""
+    return math.acos(
+        max(
+            min(math.cos(math.radians(lat1)) *
+                math.cos(math.radians(lat2)) +
+                math.sin(math.radians(lat1)) *
+                math.sin(math.radians(lat2)) *
+                math.cos(abs(math.radians(long1) -
+                             math.radians(long2))),
+                1.0),
+            -1.0))
+
+
+class World(object):
     """The world class.
 
     Part of the simulation.
@@ -18,110 +40,278 @@ class World():
     ### CREATION METHODS ####
     ##################### """
 
-    def __init__(self):
-        """Build a world."""
-        log(">> Creating cells")
-        self.create_cells()
-        log(">> Distorting terrain")
-        self.create_land()
-        self.create_terrain()
-        self.normalize_terrain()
-        log(">> Creating oceans")
-        self.create_oceans()
+    def __init__(self, build=True):
+        """Build a world.
+
+        If build is False the world is left empty, for callers that
+        run the creation methods themselves.
+        """
+        # made when first needed, see bands
+        self._bands = None
+        if build:
+            log(">> Creating cells")
+            self.create_cells()
+            log(">> Distorting terrain")
+            self.create_land()
+            self.create_terrain()
+            self.normalize_terrain()
+            log(">> Creating oceans")
+            self.create_oceans()
+            if settings.temperature_init_mode == "equilibrium":
+                log(">> Finding equilibrium temperatures")
+                self.equilibrate()
 
     def create_cells(self):
         """Create the cells.
 
         Cells are the spatial units of the world and are stored in a list.
+        Their values are held in self.state, a WorldState. If
+        settings.geometry_cache_dir is set the cells' layout and neighbors
+        are read from the geometry cache when they are there.
         """
-        self.cells = []
+        if settings.geometry_cache_dir is not None:
+            geometry = geometry_cache.load()
+            if geometry is not None:
+                log(">> Using cached geometry")
+                state = WorldState(geometry["latitude"],
+                                   geometry["longitude"])
+                state.set_neighbor_arrays(geometry["neighbor_offsets"],
+                                          geometry["neighbor_indices"])
+                self.use_state(state, RingIndex(
+                    geometry["ring_starts"], geometry["ring_counts"],
+                    settings.cell_degree_width, state.longitude))
+                return
+
+        latitudes = []
+        longitudes = []
+        # the first cell of each ring of cells at the same latitude and how
+        # many cells it has
+        offsets = []
+        counts = []
         degrees_per_cell = 360.0/float(settings.world_cell_circumference)
         for y in range(settings.world_cell_circumference/2 + 1):
             latitude = degrees_per_cell*y
 
+            offsets.append(len(latitudes))
             if latitude in [0, 180]:
-                self.cells.append(Cell(longitude=0.0, latitude=latitude))
+                counts.append(1)
+                latitudes.append(latitude)
+                longitudes.append(0.0)
             else:
                 rad = math.sin(math.radians(latitude))*settings.world_radius
                 circ = 2*math.pi*rad
                 cells = int(round(circ/float(settings.cell_width)))
+                counts.append(cells)
                 for x in range(cells):
                     longitude = (360.0/float(cells))*x
-                    self.cells.append(Cell(longitude=longitude,
-                                           latitude=latitude))
+                    latitudes.append(latitude)
+                    longitudes.append(longitude)
 
+        state = WorldState(latitudes, longitudes)
+        ring_index = RingIndex(offsets, counts, degrees_per_cell,
+                               state.longitude)
         log(">> Assigning cells neighbors")
-        for a in range(len(self.cells)):
-            cell = self.cells[a]
-            for b in range(a+1, len(self.cells)):
-                c = self.cells[b]
-                if math.acos(
-                    max(
-                        min(math.cos(math.radians(cell.latitude)) *
-                            math.cos(math.radians(c.latitude)) +
-                            math.sin(math.radians(cell.latitude)) *
-                            math.sin(math.radians(c.latitude)) *
-                            math.cos(abs(math.radians(cell.longitude) -
-                                         math.radians(c.longitude))),
-                            1.0),
-                        -1.0)) < 1.3*math.radians(degrees_per_cell):
-                    cell.neighbors.append(c)
-                    c.neighbors.append(cell)
+        state.neighbors = self.find_neighbors(ring_index, latitudes,
+                                              longitudes)
+        self.use_state(state, ring_index)
+
+        if settings.geometry_cache_dir is not None:
+            geometry_cache.store(latitudes, longitudes, ring_index,
+                                 *state.neighbor_arrays())
+
+    def use_state(self, state, ring_index=None):
+        """Make state the world's state.
+
+        The state's rings are indexed in self.ring_index. If ring_index is
+        not given it is worked out from the cells' latitudes. The cells that
+        view each element are made when first used (see cells).
+        """
+        self.close()
+        self.state = state
+        if ring_index is None:
+            ring_index = RingIndex.from_latitudes(state.latitude,
+                                                  state.longitude)
+        self.ring_index = ring_index
+        self._cells = None
+        self.distance_cache = OrderedDict()
+        # made when first needed, see cell_vectors
+        self.vectors = None
+
+    @property
+    def cells(self):
+        """The cells, a Cell to view each element of the state.
+
+        They are made when first used: the arrays physics modes do not need
+        them, so a restored world can step without making them.
+        """
+        if self._cells is None:
+            cells = [Cell(self.state, i) for i in range(len(self.state))]
+            offsets, indices = self.state.neighbor_arrays()
+            offsets = offsets.tolist()
+            indices = indices.tolist()
+            for i, cell in enumerate(cells):
+                cell.neighbors = [cells[n] for n in
+                                  indices[offsets[i]:offsets[i + 1]]]
+            self._cells = cells
+        return self._cells
+
+    @property
+    def config(self):
+        """The Config the world's physics runs with, held by its state."""
+        return self.state.config
+
+    @config.setter
+    def config(self, config):
+        self.state.config = config
+
+    def find_neighbors(self, ring_index, latitudes, longitudes):
+        """The neighbors of each cell, as lists of indices.
+
+        Cells less than 1.3 cell widths apart are neighbors.
+
+        Rings are a cell width of latitude apart, so rings two apart are
+        already more than 1.3 cell widths apart and a cell's neighbors can
+        only be in its own ring or the rings either side of it. Within
+        those rings only cells whose longitude is close enough can qualify,
+        so each cell is tested against a small window of candidates rather
+        than against every cell in the world.
+        """
+        max_distance = 1.3*math.radians(
+            360.0/float(settings.world_cell_circumference))
+        neighbors = [[] for _ in latitudes]
+        for r in range(len(ring_index)):
+            for other in [r, r + 1]:
+                if other == len(ring_index):
+                    continue
+                for a in ring_index.ring(r):
+                    for b in self.nearby_cells(
+                            latitudes[a], longitudes[a],
+                            ring_index, other, latitudes, max_distance):
+                        if b > a and great_circle_distance(
+                                latitudes[a], longitudes[a],
+                                latitudes[b], longitudes[b]) < max_distance:
+                            neighbors[a].append(b)
+                            neighbors[b].append(a)
+
+        for n in neighbors:
+            n.sort()
+        return neighbors
+
+    def nearby_cells(self, latitude, longitude, ring_index, r, latitudes,
+                     distance):
+        """Indices of the cells in ring r that might be within distance.
+
+        The window is padded by a cell either side, so it always includes
+        every cell that is actually within distance (radians).
+        """
+        start = int(ring_index.offsets[r])
+        n = int(ring_index.counts[r])
+        if n == 1 or latitude in [0, 180]:
+            return range(start, start + n)
+
+        # the largest difference in longitude that can be close enough
+        a = math.radians(latitude)
+        b = math.radians(latitudes[start])
+        limit = ((math.cos(distance) - math.cos(a)*math.cos(b)) /
+                 (math.sin(a)*math.sin(b)))
+        if limit <= -1:
+            return range(start, start + n)
+        elif limit > 1:
+            return []
+
+        spacing = float(ring_index.spacing[r])
+        width = int(math.degrees(math.acos(limit))/spacing) + 2
+        if 2*width + 1 >= n:
+            return range(start, start + n)
+        centre = int(longitude/spacing)
+        return [start + (x % n)
+                for x in range(centre - width, centre + width + 1)]
 
     def create_land(self):
-        """Add land to each cell."""
-        vol_per_cell = settings.cell_area * settings.land_depth
-        mass_per_cell = vol_per_cell*settings.land_density
-        for c in self.cells:
-            c.add_material("land",
-                           mass_per_cell,
-                           settings.initial_land_temperature)
+        """Add land to each cell.
 
-    def create_terrain(self):
-        """Assign height values to the land."""
+        This is Cell.add_material for every cell at once, so no cell's Land
+        view is made.
+        """
+        vol_per_cell = self.config.cell_area * self.config.land_depth
+        mass_per_cell = vol_per_cell*self.config.land_density
+        self.state.land_mass += mass_per_cell
+        self.state.land_energy += (settings.initial_land_temperature *
+                                   mass_per_cell *
+                                   self.config.land_specific_heat_capacity)
+
+    def create_terrain(self, n_distortions=None, chunk_size=None):
+        """Assign height values to the land.
+
+        The terrain is the sum of n_distortions bumps centred on random
+        points. Distances come from the angles between unit vectors (see
+        angles_between), worked out for chunk_size cells at a time to bound
+        memory use.
+        """
         # see http://mathworld.wolfram.com/GreatCircle.html
-        settings.n_distortions = 1000
-        longs = [random.choice(self.cells).longitude
-                 for _ in range(settings.n_distortions)]
-        lats = [random.choice(self.cells).latitude
-                for _ in range(settings.n_distortions)]
-        heights = [5000]*len(range(settings.n_distortions))
-        rates = [random.random()*3 + 3 for _ in range(settings.n_distortions)]
-
-        for cell in self.cells:
-            distances = [settings.world_radius*math.acos(
-                max(min(
-                    math.cos(math.radians(cell.latitude)) *
-                    math.cos(math.radians(lat)) +
-                    math.sin(math.radians(cell.latitude)) *
-                    math.sin(math.radians(lat)) *
-                    math.cos(abs(math.radians(cell.longitude) -
-                                 math.radians(long))),
-                    1.0), -1.0))
-                for lat, long in zip(lats, longs)]
-            hs = [h / (d/(100000*r) + 1)
-                  for h, d, r in zip(heights, distances, rates)]
-            cell.land.height += sum(hs)
+        if n_distortions is None:
+            n_distortions = settings.n_distortions
+        if chunk_size is None:
+            chunk_size = settings.terrain_chunk_size
+        # drawing indices rather than cells, so no Cell is made
+        indices = xrange(len(self.state))
+        longs = [self.state.longitude[random.choice(indices)]
+                 for _ in range(n_distortions)]
+        lats = [self.state.latitude[random.choice(indices)]
+                for _ in range(n_distortions)]
+        heights = np.array([5000]*n_distortions, dtype=float)
+        rates = np.array([random.random()*3 + 3
+                          for _ in range(n_distortions)])
+
+        points = unit_vectors(lats, longs)
+        cells = self.cell_vectors()
+        for start in range(0, len(cells), chunk_size):
+            chunk = cells[start:start + chunk_size]
+            distances = settings.world_radius*angles_between(chunk, points)
+            hs = heights / (distances/(100000*rates) + 1)
+            self.state.land_height[start:start + chunk_size] += hs.sum(axis=1)
 
     def create_oceans(self):
         """Create water."""
         if settings.water_init_mode == "even":
-            water_mass_per_cell = settings.world_water_mass/len(self.cells)
-            for cell in self.cells:
-                cell.add_material("water",
-                                  water_mass_per_cell,
-                                  settings.initial_water_temperature)
+            water_mass_per_cell = settings.world_water_mass/len(self.state)
+            self.state.water_mass += water_mass_per_cell
+            self.state.water_energy += (
+                settings.initial_water_temperature * water_mass_per_cell *
+                self.config.water_specific_heat_capacity)
         elif settings.water_init_mode == "dump":
-            cell = random.choice(self.cells)
+            cell = Cell(self.state, random.choice(xrange(len(self.state))))
             cell.add_material("water",
                               settings.world_water_mass,
                               settings.initial_water_temperature)
 
+    def equilibrate(self):
+        """Set the land and water to their equilibrium temperatures.
+
+        These are worked out directly for the land and water as they are
+        now, rather than by stepping (see equilibrium.py).
+        """
+        equilibrium.equilibrate(self.state)
+
     def slosh_oceans(self):
         """Move water between cells according to gravity.
 
-        This method deviates from real physics.
+        This method deviates from real physics. With the arrays physics
+        mode, settings.slosh_mode chooses between moving water cell by cell
+        ("sequential") and moving it across every edge at once ("edges").
+        The bands physics mode always moves it across every edge at once.
         """
+        if settings.physics_mode == "arrays":
+            if settings.slosh_mode == "sequential":
+                self.state.slosh_oceans()
+            elif settings.slosh_mode == "edges":
+                self.state.slosh_oceans_by_edge()
+            return
+        elif settings.physics_mode == "bands":
+            self.bands().run_phase("slosh_oceans")
+            return
+
+        config = self.config
         index = range(len(self.cells))
         random.shuffle(index)
         for i in index:
@@ -134,14 +324,14 @@ class World():
                                       cell.surface_height - n.surface_height)
                     if height_diff > 0:
                         wave_height = min(cell.water.depth, height_diff/2)
-                        wave_area = wave_height*settings.cell_width
+                        wave_area = wave_height*config.cell_width
                         wave_vol = max(wave_area * 2.0,
-                                       1.0) * settings.time_step_size
-                        max_vol_loosable = min(settings.cell_width * wave_area,
+                                       1.0) * config.time_step_size
+                        max_vol_loosable = min(config.cell_width * wave_area,
                                                cell.water.volume)
                         vol_moved = min(wave_vol,
                                         max_vol_loosable)
-                        mass_moved = vol_moved * settings.water_density
+                        mass_moved = vol_moved * config.water_density
                         temp = cell.water.temperature
                         cell.add_material("water",
                                           -mass_moved,
@@ -162,28 +352,70 @@ class World():
         https://en.wikipedia.org/wiki/Stefan-Boltzmann_constant
         eden/docs/thermal energy formulae.docx
         """
-        for c in self.cells:
-            c.radiate_energy_vertically()
-            c.conduct_energy_vertically()
+        if settings.physics_mode == "arrays":
+            if settings.validate_columns:
+                self.validate_columns(
+                    self.state.transfer_energy_vertically,
+                    lambda c: (c.radiate_energy_vertically(),
+                               c.conduct_energy_vertically()))
+            else:
+                self.state.transfer_energy_vertically()
+        elif settings.physics_mode == "bands":
+            self.bands().run_phase("transfer_energy_vertically")
+        elif settings.physics_mode == "cells":
+            for c in self.cells:
+                c.radiate_energy_vertically()
+                c.conduct_energy_vertically()
 
     def transfer_energy_horizontally(self):
-        """Transfer energy between neighboring tiles."""
-        for c in self.cells:
-            c.conduct_energy_horizontally()
+        """Transfer energy between neighboring tiles.
 
-    def absorb_energy_from_sun(self, sun):
-        """Gain thermal energy (kJ) from the sun."""
-        max_E = settings.cell_area / (4 * math.pi * pow(sun.distance, 2))\
-            * sun.power * settings.time_step_size
+        With the arrays physics mode, settings.conduction_mode chooses
+        between conducting cell by cell ("sequential") and conducting across
+        every edge at once ("edges"). The bands physics mode always conducts
+        across every edge at once.
+        """
+        if settings.physics_mode == "arrays":
+            if settings.conduction_mode == "sequential":
+                self.state.transfer_energy_horizontally()
+            elif settings.conduction_mode == "edges":
+                self.state.transfer_energy_horizontally_by_edge()
+        elif settings.physics_mode == "bands":
+            self.bands().run_phase("transfer_energy_horizontally")
+        elif settings.physics_mode == "cells":
+            for c in self.cells:
+                c.conduct_energy_horizontally()
+
+    def absorb_energy_from_sun(self):
+        """Gain thermal energy (kJ) from the sun.
+
+        The sun's power and distance are those in the world's Config.
+        """
+        max_E = self.config.max_solar_energy
 
-        for c in self.cells:
-            c.gain_solar_energy(max_E*c.facing_sun)
+        if settings.physics_mode == "arrays":
+            if settings.validate_columns:
+                self.validate_columns(
+                    lambda: self.state.absorb_energy_from_sun(max_E),
+                    lambda c: c.gain_solar_energy(max_E*c.facing_sun))
+            else:
+                self.state.absorb_energy_from_sun(max_E)
+        elif settings.physics_mode == "bands":
+            self.bands().run_phase("absorb_energy_from_sun")
+        elif settings.physics_mode == "cells":
+            for c in self.cells:
+                c.gain_solar_energy(max_E*c.facing_sun)
 
     def absorb_energy_from_core(self):
         """Gain thermal energy (kJ) from within the earth."""
-        E = (settings.world_power * settings.time_step_size) / len(self.cells)
-        for c in self.cells:
-            c.gain_core_energy(E)
+        E = self.config.core_energy
+        if settings.physics_mode == "arrays":
+            self.state.absorb_energy_from_core(E)
+        elif settings.physics_mode == "bands":
+            self.bands().run_phase("absorb_energy_from_core")
+        elif settings.physics_mode == "cells":
+            for c in self.cells:
+                c.gain_core_energy(E)
 
     def conduct_energy_between_cells(self):
         """Transmit thermal energy between neighboring cells.
@@ -201,38 +433,152 @@ class World():
     #### SUPPORT METHODS ####
     ######################"""
 
-    def normalize_terrain(self):
-        """Adjust land heights so they fit within bounds and average is 0."""
-        heights = [t.land.height for t in self.cells]
-        mean_height = sum(heights)/len(heights)
-        for t in self.cells:
-            t.land.height = t.land.height - mean_height
+    def bands(self):
+        """The Bands that run the bands physics mode, made when first used.
 
-        heights = [t.land.height for t in self.cells]
+        The world is split into settings.bands latitude bands. Changing
+        that setting later makes new Bands.
+        """
+        if self._bands is not None and len(self._bands) != settings.bands:
+            self.close()
+        if self._bands is None:
+            self._bands = Bands(self.state, self.ring_index, settings.bands)
+        return self._bands
+
+    def close(self):
+        """Stop any processes running the world's physics."""
+        if self._bands is not None:
+            self._bands.close()
+            self._bands = None
+
+    def substeps(self, group):
+        """How many sub-steps the group of phases called group needs."""
+        config = self.config
+        if group == "slosh_oceans":
+            # water moves in proportion to the step until a wave's width
+            n = 2.0*config.time_step_size/config.cell_width
+        elif group == "transfer_energy_horizontally":
+            n = (self.state.conduction_rate()*config.time_step_size /
+                 settings.substep_limit)
+        elif group == "column":
+            n = (self.state.radiation_rate()*config.time_step_size /
+                 settings.substep_limit)
+        else:
+            return 1
+        return int(max(1, math.ceil(n)))
+
+    def long_step(self, group, substeps):
+        """Run a group needing more than settings.max_substeps sub-steps."""
+        if group == "slosh_oceans":
+            self.settle_oceans(substeps)
+        elif group == "transfer_energy_horizontally":
+            implicit.transfer_energy_horizontally(self.state)
+        elif group == "column":
+            implicit.transfer_energy_in_columns(self.state)
+
+    def settle_oceans(self, substeps):
+        """Slosh for up to substeps sub-steps, until the water settles.
+
+        It has settled once no cell's water depth changes by more than
+        settings.settled_depth (m) in a sub-step.
+        """
+        config = self.config
+        state = self.state
+        self.config = config.with_time_step(
+            config.time_step_size/float(substeps))
+        try:
+            for _ in xrange(substeps):
+                before = state.water_mass.copy()
+                self.slosh_oceans()
+                change = np.abs(state.water_mass - before).max()
+                if change <= (settings.settled_depth*config.water_density *
+                              config.cell_area):
+                    return
+        finally:
+            self.config = config
+
+    def validate_columns(self, kernel, per_cell):
+        """Check the column kernel against the per-cell methods.
+
+        kernel runs a phase on the arrays and per_cell(c) runs it for cell
+        c. Both are run from the same state, which is left as per_cell
+        leaves it. Raises a ValueError if any cell's land or water energy
+        differs by more than settings.column_tolerance times that material's
+        energy, or its energy at 1 K if that is more.
+        """
+        state = self.state
+        before = (state.land_energy.copy(), state.water_energy.copy())
+        kernel()
+        results = (state.land_energy.copy(), state.water_energy.copy())
+        state.land_energy[:], state.water_energy[:] = before
+        for c in self.cells:
+            per_cell(c)
+
+        config = self.config
+        for name, result, capacity in [
+                ("land_energy", results[0],
+                 state.land_mass*config.land_specific_heat_capacity),
+                ("water_energy", results[1],
+                 state.water_mass*config.water_specific_heat_capacity)]:
+            energy = getattr(state, name)
+            scale = np.maximum(np.abs(energy), capacity)
+            error = np.abs(result - energy)
+            error = (np.divide(error, scale, out=error, where=scale > 0)
+                     .max() if len(error) else 0.0)
+            debug("column kernel {} error: {}".format(name, error))
+            if error > settings.column_tolerance:
+                raise ValueError(
+                    "column kernel {} differs from the per-cell methods by "
+                    "{} of the material's energy".format(name, error))
 
-        scale = max([1, min(heights)/settings.min_ground_height, max(heights) /
-                     settings.max_ground_height])
-        for t in self.cells:
-            t.land.height = t.land.height/scale
+    def normalize_terrain(self):
+        """Adjust land heights so they fit within bounds and average is 0."""
+        heights = self.state.land_height
+        heights -= heights.mean()
+        scale = max([1, heights.min()/settings.min_ground_height,
+                     heights.max()/settings.max_ground_height])
+        heights /= scale
 
     def raise_cell(self, cell_id, height):
         """Raise a cells land height."""
-        cell = self.cells[cell_id]
-
-        long = cell.longitude
-        lat = cell.latitude
-        rate = random.random()*3 + 3
-
-        for cell in self.cells:
-            distance = settings.world_radius*math.acos(
-                max(min(
-                    math.cos(math.radians(cell.latitude)) *
-                    math.cos(math.radians(lat)) +
-                    math.sin(math.radians(cell.latitude)) *
-                    math.sin(math.radians(lat)) *
-                    math.cos(abs(math.radians(cell.longitude) -
-                                 math.radians(long))),
-                    1.0), -1.0))
-            hs = height / (distance/(100000*rate) + 1)
-            cell.land.height += hs
+        self.raise_cells([cell_id], [height])
+
+    def raise_cells(self, cell_ids, heights):
+        """Raise the land around several cells at once.
+
+        Each cell and height is one stroke of raise_cell, but all strokes are
+        applied together and the terrain is normalized once at the end.
+        """
+        rates = np.array([random.random()*3 + 3 for _ in cell_ids])
+        distances = np.array([self.distances_from(c) for c in cell_ids])
+        hs = np.array(heights, dtype=float)[:, np.newaxis] / (
+            distances/(100000*rates[:, np.newaxis]) + 1)
+        self.state.land_height += hs.sum(axis=0)
         self.normalize_terrain()
+
+    def cell_vectors(self):
+        """Unit vectors pointing at each cell, worked out once per world.
+
+        Cells never move, so these only change with the state.
+        """
+        if self.vectors is None:
+            self.vectors = unit_vectors(self.state.latitude,
+                                        self.state.longitude)
+        return self.vectors
+
+    def distances_from(self, index):
+        """Distances (m) from the cell with state index to every cell.
+
+        Brush strokes tend to hit the same cells, so recent rows are kept in
+        an LRU cache of up to settings.distance_cache_size rows.
+        """
+        if index in self.distance_cache:
+            row = self.distance_cache.pop(index)
+        else:
+            vectors = self.cell_vectors()
+            row = settings.world_radius*angles_between(
+                vectors, vectors[index:index + 1])[:, 0]
+        self.distance_cache[index] = row
+        while len(self.distance_cache) > settings.distance_cache_size:
+            self.distance_cache.popitem(last=False)
+        return row
@@ -0,0 +1,563 @@
+"""The world state: per-cell fields stored as contiguous arrays."""
+
+import math
+import random
+from collections import OrderedDict
+import numpy as np
+from column_kernel import ColumnKernel
+from config import Config
+import settings
+
+
+class WorldState(object):
+    """The state of every cell in the world, held as NumPy arrays.
+
+    Element i of each array belongs to the cell with index i. Cells are thin
+    views onto this object, so the arrays are the single source of truth.
+    The methods below are array versions of the per-cell physics in cell.py.
+    They read their constants from self.config, a Config.
+    """
+
+    # the arrays that, with the neighbors, hold everything about the state
+    fields = ["latitude", "longitude", "land_mass", "land_energy",
+              "land_height", "water_mass", "water_energy"]
+
+    def __init__(self, latitudes, longitudes, config=None):
+        """Create the state for cells at the given coordinates.
+
+        If config is not given one is made from the current settings.
+        """
+        self.latitude = np.array(latitudes, dtype=float)
+        self.longitude = np.array(longitudes, dtype=float)
+        self.facing_sun = np.sin(np.radians(self.latitude))
+        self.water_albedo = settings.water_albedo(self.facing_sun)
+
+        n = len(self.latitude)
+        self.land_mass = np.zeros(n)
+        self.land_energy = np.zeros(n)
+        self.land_height = np.zeros(n)
+        self.water_mass = np.zeros(n)
+        self.water_energy = np.zeros(n)
+
+        self.config = config if config is not None else Config(n)
+
+        # made when first needed, see column_kernel
+        self._column_kernel = None
+
+        self.set_neighbor_arrays(np.zeros(n + 1, dtype=np.int64),
+                                 np.zeros(0, dtype=np.int32))
+
+    @classmethod
+    def from_arrays(cls, arrays, neighbor_offsets, neighbor_indices,
+                    config=None):
+        """Make a state that uses the given arrays rather than copies.
+
+        arrays holds an array for each of WorldState.fields. The neighbors
+        are given as in neighbor_arrays.
+        """
+        state = cls(arrays["latitude"], arrays["longitude"], config)
+        for field in cls.fields:
+            setattr(state, field, arrays[field])
+        state.set_neighbor_arrays(neighbor_offsets, neighbor_indices)
+        return state
+
+    def __len__(self):
+        """The number of cells."""
+        return len(self.latitude)
+
+    @property
+    def neighbors(self):
+        """neighbors[i] is a list of the indices of cell i's neighbors.
+
+        The neighbors are held in the arrays of neighbor_arrays. These lists
+        are made from them when first used, so a restored state does not
+        pay for them unless something needs them.
+        """
+        if self._neighbors is None:
+            self._neighbors = neighbor_lists(self.neighbor_offsets,
+                                             self.neighbor_indices)
+        return self._neighbors
+
+    @neighbors.setter
+    def neighbors(self, neighbors):
+        counts = [len(n) for n in neighbors]
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        indices = np.fromiter((i for n in neighbors for i in n),
+                              dtype=np.int32, count=offsets[-1])
+        self.set_neighbor_arrays(offsets, indices)
+
+    def set_neighbor_arrays(self, offsets, indices):
+        """Set the neighbors of every cell, as neighbor_arrays returns them."""
+        self.neighbor_offsets = offsets
+        self.neighbor_indices = indices
+        self._neighbors = None
+        self._edges = None
+
+    def edges(self):
+        """Every pair of neighboring cells, once each.
+
+        Returns two arrays, a and b, with a < b, sorted by a then b.
+        """
+        if self._edges is None:
+            offsets, indices = self.neighbor_arrays()
+            a = np.repeat(np.arange(len(self)), np.diff(offsets))
+            b = indices.astype(np.int64)
+            a, b = a[a < b], b[a < b]
+            order = np.lexsort((b, a))
+            self._edges = (a[order], b[order])
+        return self._edges
+
+    def neighbor_arrays(self):
+        """The neighbors of every cell, as two arrays, offsets and indices.
+
+        The neighbors of cell i are indices[offsets[i]:offsets[i + 1]].
+        These are the state's own arrays rather than copies.
+        """
+        return self.neighbor_offsets, self.neighbor_indices
+
+    """ #####################
+    ###### PROPERTIES #######
+    ######################"""
+
+    @property
+    def land_temperature(self):
+        """Temperature of the land in each cell."""
+        return temperature(self.land_energy, self.land_mass,
+                           self.config.land_specific_heat_capacity)
+
+    @property
+    def water_temperature(self):
+        """Temperature of the water in each cell."""
+        return temperature(self.water_energy, self.water_mass,
+                           self.config.water_specific_heat_capacity)
+
+    @property
+    def water_depth(self):
+        """Depth of the water in each cell."""
+        config = self.config
+        return self.water_mass / config.water_density / config.cell_area
+
+    @property
+    def surface_height(self):
+        """Height of the surface (land or sea) of each cell."""
+        return self.land_height + self.water_depth
+
+    @property
+    def surface_temperature(self):
+        """Temperature of the surface (land or sea) of each cell."""
+        return np.where(self.water_depth > 0,
+                        self.water_temperature,
+                        self.land_temperature)
+
+    """ #####################
+    ### EXECUTION METHODS ###
+    ######################"""
+
+    def slosh_oceans(self):
+        """Move water between cells according to gravity.
+
+        Water moves sequentially, cell by cell in a random order, so each
+        move sees the result of the previous one. That ordering is part of
+        the scheme and cannot be vectorized, so this runs as a loop over
+        plain floats rather than over Cell objects.
+        """
+        mass = self.water_mass.tolist()
+        energy = self.water_energy.tolist()
+        height = self.land_height.tolist()
+        config = self.config
+        c = config.water_specific_heat_capacity
+        density = config.water_density
+        area = config.cell_area
+        width = config.cell_width
+        time = config.time_step_size
+
+        offsets = self.neighbor_offsets.tolist()
+        indices = self.neighbor_indices.tolist()
+
+        index = range(len(mass))
+        random.shuffle(index)
+        for i in index:
+            if mass[i] / density / area > 0:
+                # each cell's neighbors stay in the order they are shuffled
+                # into, as cells' neighbor lists do
+                first, last = offsets[i], offsets[i + 1]
+                neighbors = indices[first:last]
+                random.shuffle(neighbors)
+                indices[first:last] = neighbors
+                for n in neighbors:
+                    depth = mass[i] / density / area
+                    height_diff = max(0, (height[i] + depth) -
+                                      (height[n] + mass[n] / density / area))
+                    if height_diff > 0:
+                        wave_height = min(depth, height_diff/2)
+                        wave_area = wave_height*width
+                        wave_vol = max(wave_area * 2.0, 1.0) * time
+                        max_vol_loosable = min(width * wave_area,
+                                               mass[i] / density)
+                        vol_moved = min(wave_vol, max_vol_loosable)
+                        mass_moved = vol_moved * density
+                        temp = (energy[i] / (mass[i] * c)
+                                if mass[i] > 0 else 0.0)
+                        mass[i] -= mass_moved
+                        energy[i] -= temp * mass_moved * c
+                        mass[n] += mass_moved
+                        energy[n] += temp * mass_moved * c
+
+        self.water_mass[:] = mass
+        self.water_energy[:] = energy
+        self.neighbor_indices[:] = indices
+        self._neighbors = None
+
+    def slosh_oceans_by_edge(self):
+        """Move water between cells according to gravity, all at once.
+
+        An alternative to slosh_oceans. The water that would flow across
+        each edge is worked out from the same snapshot of the surface,
+        using the same rule as slosh_oceans, and every flow is then applied
+        at once. Nothing is random and the result does not depend on the
+        order of the cells. Water leaving a cell is scaled down, if needed,
+        so that a cell never loses more than it holds or more than brings
+        it level with the cells it flows to. Every kg taken from one cell
+        is given to another, so the total mass of water is conserved, up to
+        the rounding errors cleared from cells that give all their water.
+        """
+        config = self.config
+        c = config.water_specific_heat_capacity
+        density = config.water_density
+        width = config.cell_width
+        a, b = self.edges()
+        source = np.concatenate((a, b))
+        target = np.concatenate((b, a))
+
+        volume = self.water_mass / density
+        depth = volume / config.cell_area
+        surface = self.land_height + depth
+        height_diff = surface[source] - surface[target]
+        flowing = (height_diff > 0) & (depth[source] > 0)
+        source = source[flowing]
+        target = target[flowing]
+
+        wave_height = np.minimum(depth[source], height_diff[flowing]/2)
+        wave_area = wave_height*width
+        wave_vol = np.maximum(wave_area * 2.0, 1.0) * config.time_step_size
+        max_vol_loosable = np.minimum(width * wave_area, volume[source])
+        vol_moved = np.minimum(wave_vol, max_vol_loosable)
+
+        # the most a cell can lose: what it holds, or what brings it level
+        # with the cells it flows to (all cells have the same area)
+        n = len(self)
+        flows = np.bincount(source, minlength=n)
+        level = (np.bincount(source, height_diff[flowing], minlength=n) /
+                 (flows + 1) * config.cell_area)
+        limit = np.minimum(volume, level)
+        total_out = np.bincount(source, vol_moved, minlength=n)
+        scale = np.ones(n)
+        np.divide(limit, total_out, out=scale, where=total_out > limit)
+        mass_moved = vol_moved * scale[source] * density
+
+        temperature = self.water_temperature
+        energy_moved = temperature[source] * mass_moved * c
+        mass_out = np.bincount(source, mass_moved, minlength=n)
+        mass_in = np.bincount(target, mass_moved, minlength=n)
+        held = self.water_mass + mass_in
+        self.water_mass -= mass_out
+        self.water_mass += mass_in
+        self.water_energy -= np.bincount(source, energy_moved, minlength=n)
+        self.water_energy += np.bincount(target, energy_moved, minlength=n)
+        # a cell that gives all its water can be left a rounding error
+        # either side of zero, with an energy that means nothing, so
+        # anything within rounding of what it held is emptied
+        empty = (mass_out > 0) & (self.water_mass <=
+                                  4*np.finfo(float).eps*held)
+        self.water_mass[empty] = 0.0
+        self.water_energy[empty] = 0.0
+
+    def transfer_energy_vertically(self):
+        """Transfer energy between land/water/space in every cell."""
+        self.column_kernel().transfer_energy_vertically(self)
+
+    def transfer_energy_horizontally(self):
+        """Conduct energy between neighboring cells.
+
+        Like slosh_oceans this visits cells in turn and each exchange sees
+        the previous ones, so it runs as a loop over plain floats.
+        """
+        land_energy = self.land_energy.tolist()
+        land_mass = self.land_mass.tolist()
+        water_energy = self.water_energy.tolist()
+        water_mass = self.water_mass.tolist()
+        config = self.config
+        land_c = config.land_specific_heat_capacity
+        water_c = config.water_specific_heat_capacity
+        land_conduction = config.land_edge_conduction
+        water_conduction = config.water_edge_conduction
+        density = config.water_density
+        area = config.cell_area
+        offsets = self.neighbor_offsets.tolist()
+        indices = self.neighbor_indices.tolist()
+
+        for i in range(len(land_mass)):
+            neighbors = indices[offsets[i]:offsets[i + 1]]
+            for n in neighbors:
+                loss = _conducted_energy(
+                    land_energy[i], land_mass[i], land_c,
+                    land_energy[n], land_mass[n], land_c,
+                    land_conduction)
+                land_energy[i] -= loss
+                land_energy[n] += loss
+            if water_mass[i] > 0:
+                for n in neighbors:
+                    if water_mass[n] > 0:
+                        mean_depth = (water_mass[i] / density / area +
+                                      water_mass[n] / density / area)/2
+                        loss = _conducted_energy(
+                            water_energy[i], water_mass[i], water_c,
+                            water_energy[n], water_mass[n], water_c,
+                            mean_depth*water_conduction)
+                        water_energy[i] -= loss
+                        water_energy[n] += loss
+
+        self.land_energy[:] = land_energy
+        self.water_energy[:] = water_energy
+
+    def transfer_energy_horizontally_by_edge(self):
+        """Conduct energy between neighboring cells, across every edge at once.
+
+        An alternative to transfer_energy_horizontally. Each pair of
+        neighbors is visited once, the exchange across every edge is worked
+        out from the same snapshot and all exchanges are applied at once, so
+        the result does not depend on the order of the cells. Energy
+        leaving one cell always arrives in another, so it is conserved.
+        """
+        config = self.config
+        a, b = self.edges()
+        self.land_energy += conduct_across_edges(
+            self.land_energy, self.land_mass,
+            config.land_specific_heat_capacity,
+            config.land_edge_conduction, a, b)
+
+        wet = (self.water_mass[a] > 0) & (self.water_mass[b] > 0)
+        a, b = a[wet], b[wet]
+        depth = self.water_depth
+        mean_depth = (depth[a] + depth[b])/2
+        self.water_energy += conduct_across_edges(
+            self.water_energy, self.water_mass,
+            config.water_specific_heat_capacity,
+            mean_depth*config.water_edge_conduction, a, b)
+
+    def conduction_rate(self):
+        """The fastest any cell's temperature follows its neighbors' (1/s).
+
+        Across an edge the temperature of a cell with heat capacity mc
+        closes on its neighbor's at k*area/mc. This totals that rate over
+        each cell's edges, for land and for water, using the heavier cell
+        of each edge: a cell with almost no water comes to equilibrium
+        within any step, but holds too little energy for that to matter.
+        Times a time step, the result is about how far towards equilibrium
+        with its neighbors a cell could get in that step.
+        """
+        a, b = self.edges()
+        if len(a) == 0:
+            return 0.0
+        n = len(self)
+        config = self.config
+        rates = heavier_rates(self.land_mass,
+                              config.land_specific_heat_capacity,
+                              config.land_conductance, a, b)
+        total = (np.bincount(a, rates, minlength=n) +
+                 np.bincount(b, rates, minlength=n))
+
+        wet = (self.water_mass[a] > 0) & (self.water_mass[b] > 0)
+        a, b = a[wet], b[wet]
+        depth = self.water_depth
+        rates = heavier_rates(self.water_mass,
+                              config.water_specific_heat_capacity,
+                              (depth[a] + depth[b])/2*config.water_conductance,
+                              a, b)
+        total = np.maximum(total, np.bincount(a, rates, minlength=n) +
+                           np.bincount(b, rates, minlength=n))
+        return total.max()
+
+    def radiation_rate(self):
+        """The fastest any column's temperature follows its radiation (1/s).
+
+        Radiating, a material at temperature T loses 4*emission*T^3 more
+        power per K warmer it gets (water twice over, as it radiates twice).
+        This totals that over each column's land and water and divides it
+        by their heat capacity, taking the land and water together as
+        conduction ties them: water with almost no mass follows its land.
+        Times a time step, the result is about how far towards the
+        temperature at which it radiates what it is given a column could
+        get in that step.
+        """
+        if len(self) == 0:
+            return 0.0
+        config = self.config
+        wet = self.water_mass > 0
+        land_t = self.land_temperature
+        water_t = self.water_temperature
+        radiation = (4*config.land_emission*land_t**3 +
+                     np.where(wet, 8*config.water_emission*water_t**3, 0.0))
+        capacity = (self.land_mass*config.land_specific_heat_capacity +
+                    self.water_mass*config.water_specific_heat_capacity)
+        rates = np.zeros(len(self))
+        np.divide(radiation, capacity, out=rates, where=capacity > 0)
+        return rates.max()
+
+    def absorb_energy_from_sun(self, max_E):
+        """Absorb solar energy given the energy a cell facing the sun gets."""
+        self.column_kernel().absorb_energy_from_sun(self, max_E)
+
+    def absorb_energy_from_core(self, E):
+        """Give each cell's land E energy from the core."""
+        self.land_energy += E
+
+    """ #####################
+    #### SUPPORT METHODS ####
+    ######################"""
+
+    def column_kernel(self):
+        """The ColumnKernel for this state, made the first time it is used."""
+        if self._column_kernel is None:
+            self._column_kernel = ColumnKernel(len(self))
+        return self._column_kernel
+
+    def diagnostics(self):
+        """Global summary values of the state, as an OrderedDict."""
+        land_temperature = self.land_temperature
+        wet = self.water_mass > 0
+        water_temperature = self.water_temperature[wet]
+        if not wet.any():
+            water_temperature = np.zeros(1)
+        return OrderedDict([
+            ("mean_land_temperature", land_temperature.mean()),
+            ("min_land_temperature", land_temperature.min()),
+            ("max_land_temperature", land_temperature.max()),
+            ("mean_water_temperature", water_temperature.mean()),
+            ("min_water_temperature", water_temperature.min()),
+            ("max_water_temperature", water_temperature.max()),
+            ("total_water_mass", self.water_mass.sum()),
+            ("wet_fraction", wet.mean()),
+            ("total_thermal_energy",
+             self.land_energy.sum() + self.water_energy.sum())
+        ])
+
+
+def unit_vectors(latitudes, longitudes):
+    """Unit vectors (one per row) pointing at points on the world.
+
+    Latitude is measured from the pole, as it is for cells.
+    """
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.column_stack((np.sin(lat)*np.cos(lon),
+                            np.sin(lat)*np.sin(lon),
+                            np.cos(lat)))
+
+
+def angles_between(vectors, points):
+    """The angles (radians) between unit vectors and points, pairwise.
+
+    vectors and points hold a unit vector per row; element (i, j) of the
+    result is the angle between vectors[i] and points[j]. It is worked out
+    from both the cross and dot products, as the arccos of the dot product
+    alone loses precision for nearby points.
+    """
+    x, y, z = np.asarray(vectors).T
+    px, py, pz = np.asarray(points).T
+    cross = np.sqrt((np.outer(y, pz) - np.outer(z, py))**2 +
+                    (np.outer(z, px) - np.outer(x, pz))**2 +
+                    (np.outer(x, py) - np.outer(y, px))**2)
+    return np.arctan2(cross, np.dot(vectors, np.transpose(points)))
+
+
+def neighbor_lists(offsets, indices):
+    """Lists of neighbors from the arrays made by neighbor_arrays."""
+    indices = indices.tolist()
+    offsets = offsets.tolist()
+    return [indices[offsets[i]:offsets[i + 1]]
+            for i in range(len(offsets) - 1)]
+
+
+def temperature(energy, mass, specific_heat_capacity):
+    """Temperature of materials, 0 where there is no mass."""
+    result = np.zeros(len(mass))
+    np.divide(energy, mass * specific_heat_capacity,
+              out=result, where=mass > 0)
+    return result
+
+
+def edge_rates(mass, specific_heat_capacity, conductance, a, b):
+    """The rate (1/s) at which each edge's cells approach equilibrium.
+
+    This is the rate in the exponent of Material.conduct_energy, for the
+    cells a[e] and b[e] of each edge e with conductance (thermal
+    conductivity times contact area) conductance. Given conductance times
+    a time step, it gives the exponent itself. It is worked out as
+    conductance/mc_a + conductance/mc_b, which is infinite rather than
+    undefined for a cell with almost no mass. Edges with a cell that has
+    no mass at all have a rate of 0.
+    """
+    mc = mass * specific_heat_capacity
+    inverse = np.zeros(len(mc))
+    with np.errstate(over="ignore"):
+        np.divide(1.0, mc, out=inverse, where=mc > 0)
+        rates = conductance*inverse[a] + conductance*inverse[b]
+    rates[(mc[a] <= 0) | (mc[b] <= 0)] = 0.0
+    return rates
+
+
+def heavier_rates(mass, specific_heat_capacity, conductance, a, b):
+    """The rate (1/s) the heavier cell of each edge nears equilibrium at.
+
+    This is for the cells a[e] and b[e] of each edge e, with conductance
+    conductance.
+    """
+    return conductance / (
+        np.maximum(mass[a], mass[b]) * specific_heat_capacity)
+
+
+def conduct_across_edges(energy, mass, specific_heat_capacity, conduction,
+                         a, b):
+    """The change in each cell's energy from conduction across edges.
+
+    Edge e joins cells a[e] and b[e]. conduction is the conductance across
+    each edge times the time step (a number or an array with one value per
+    edge). Across each edge the closed form exchange of
+    Material.conduct_energy is used. If the exchanges a cell takes part in
+    would together move it more than all the way to equilibrium with its
+    neighbors, they are scaled down, so every cell ends up between its old
+    temperature and its neighbors' and long time steps cannot make
+    temperatures oscillate.
+    """
+    n = len(energy)
+    mc = mass * specific_heat_capacity
+    mc_a = mc[a]
+    mc_b = mc[b]
+    # the fraction of the way to equilibrium each pair gets, which is 1
+    # where the rate is infinite
+    fraction = -np.expm1(
+        -edge_rates(mass, specific_heat_capacity, conduction, a, b))
+    total = (np.bincount(a, fraction, minlength=n) +
+             np.bincount(b, fraction, minlength=n))
+    fraction /= np.maximum(1, np.maximum(total[a], total[b]))
+
+    # energy flowing from a to b, which is negative if b is hotter
+    flow = np.zeros(len(fraction))
+    np.divide(fraction * (energy[a]*mc_b - energy[b]*mc_a), mc_a + mc_b,
+              out=flow, where=fraction > 0)
+    return (np.bincount(b, flow, minlength=n) -
+            np.bincount(a, flow, minlength=n))
+
+
+def _conducted_energy(E0, m0, c0, E1, m1, c1, conduction):
+    """Energy conducted from material 0 to 1, as Material.conduct_energy."""
+    t0 = E0 / (m0 * c0) if m0 > 0 else 0.0
+    t1 = E1 / (m1 * c1) if m1 > 0 else 0.0
+    if t0 > t1:
+        mc0 = m0 * c0
+        mc1 = m1 * c1
+        return (mc0 * mc1 / (mc0 + mc1) * (t0 - t1) *
+                -math.expm1((-conduction * (mc0 + mc1)) / (mc0 * mc1)))
+    return 0.0